@@ -0,0 +1,1091 @@
+#!/usr/bin/env python3
+"""Standalone media library scan agent.
+
+Walks the configured roots, classifies and hashes media files, optionally
+probes videos with ffprobe, and posts batches of results to the ingest
+server. The local SQLite cache (app.agent_cache) remembers what has
+already been hashed/probed so unchanged files are skipped on later
+passes, and an outbox table holds batches that could not be delivered.
+
+Run with:  python agent.py --config agent_config.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import fnmatch
+import functools
+import gzip
+import hashlib
+import io
+import json
+import mmap
+import os
+import queue
+import re
+import sqlite3
+import struct
+import shutil
+import sys
+import threading
+import time
+import types
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter, Retry
+
+from app import agent_cache
+
+# One keep-alive session shared by every server call: batches, config
+# polls and outbox drains reuse the same pooled connection instead of
+# paying a TCP (and possibly TLS) handshake per request.
+_SESSION = requests.Session()
+_SESSION.headers.update({"Accept-Encoding": "gzip"})
+for _scheme in ("http://", "https://"):
+    _SESSION.mount(_scheme, HTTPAdapter(
+        pool_connections=4, pool_maxsize=16,
+        max_retries=Retry(total=3, backoff_factor=0.5)))
+
+try:
+    from blake3 import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+
+def _json_default(obj: Any) -> Any:
+    """Teach the stdlib encoder about the slotted item dataclasses."""
+    return asdict(obj)
+
+
+def _dumps_bytes(obj: Any) -> bytes:
+    """Serialize to UTF-8 JSON bytes, via orjson when available."""
+    if orjson is not None:
+        # orjson serializes dataclasses natively, no asdict() detour.
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"),
+                      default=_json_default).encode("utf-8")
+
+
+@dataclass(slots=True)
+class HashInfo:
+    """Hash fields for one file; slotted so a scan of millions of files
+    allocates fixed-size objects instead of per-item dicts."""
+
+    algo: str
+    sample_size: int
+    sample_hash: str
+    full_hash: Optional[str] = None
+
+
+@dataclass(slots=True)
+class Item:
+    """One file's ingest payload entry."""
+
+    path: str
+    kind: str
+    size: int
+    mtime: float
+    hashes: Optional[HashInfo] = None
+    probe: Optional[dict] = None
+
+DEFAULT_CONFIG: dict[str, Any] = {
+    "server_base": "http://127.0.0.1:8765",
+    "roots": [],
+    "video_exts": [".mp4", ".mkv", ".avi", ".mov", ".wmv", ".flv", ".m4v",
+                   ".mpg", ".mpeg", ".ts", ".webm"],
+    "image_exts": [".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".webp"],
+    "subtitle_exts": [".srt", ".sub", ".ass", ".ssa", ".vtt", ".idx"],
+    "xml_exts": [".nfo", ".xml"],
+    "other_exts": [".txt", ".json", ".log"],
+    "junk_patterns": ["*.tmp", "*.part", "*.crdownload", "*.!qb",
+                      "thumbs.db", ".ds_store", "desktop.ini"],
+    "junk_exclude_exts": [],
+    "hash_algo": "sha256",
+    "sample_size": 1048576,
+    "full_hash_max_bytes": 268435456,
+    "batch_size": 500,
+    "use_gzip": True,
+    "agent_max_workers": 4,
+    "sleep_secs": 300,
+    "follow_links": False,
+    "cache_db": "agent_cache.db",
+}
+
+
+def load_config(path: Optional[str]) -> dict[str, Any]:
+    cfg = dict(DEFAULT_CONFIG)
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            cfg.update(json.load(f))
+    return cfg
+
+
+def fetch_config(server_base: str) -> dict[str, Any]:
+    """Pull config overrides pushed by the server, if any."""
+    r = _SESSION.get(server_base + "/ingest/config", timeout=10)
+    r.raise_for_status()
+    data = r.json()
+    return data if isinstance(data, dict) else {}
+
+
+@functools.lru_cache(maxsize=1)
+def has_ffprobe() -> bool:
+    # Memoized: shutil.which re-walks $PATH (a stat per directory) on
+    # every call, and build_item asks once per video.
+    return shutil.which("ffprobe") is not None
+
+
+class _ProbeRunner:
+    """Multiplexes ffprobe subprocesses on one asyncio loop thread.
+
+    asyncio.create_subprocess_exec spawns via posix_spawn (no fork of
+    the agent's full address space) and one loop services every probe's
+    pipe, so hash workers hand a path over and block only on the
+    result instead of each sitting in its own subprocess.run. The
+    semaphore caps concurrent ffprobe processes.
+    """
+
+    def __init__(self, width: Optional[int] = None):
+        self._width = width or min(8, os.cpu_count() or 4)
+        self._sem = asyncio.Semaphore(self._width)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run,
+                                        name="agent-ffprobe", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    async def _probe(self, path: str) -> Optional[dict]:
+        async with self._sem:
+            proc = None
+            try:
+                # -threads 1 keeps each probe from oversubscribing
+                # cores; the probesize/analyzeduration caps bound how
+                # much of the file a single probe may chew on.
+                proc = await asyncio.create_subprocess_exec(
+                    "ffprobe", "-v", "error", "-threads", "1",
+                    "-probesize", "5000000", "-analyzeduration", "5000000",
+                    "-print_format", "json",
+                    "-show_format", "-show_streams", path,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.DEVNULL)
+                out, _ = await asyncio.wait_for(proc.communicate(), 60)
+            except (OSError, asyncio.TimeoutError):
+                if proc is not None:
+                    try:
+                        proc.kill()
+                    except ProcessLookupError:
+                        pass
+                return None
+            if proc.returncode != 0:
+                return None
+            try:
+                return json.loads(out.decode("utf-8", "replace"))
+            except ValueError:
+                return None
+
+    def probe(self, path: Path | str) -> Optional[dict]:
+        fut = asyncio.run_coroutine_threadsafe(self._probe(str(path)),
+                                               self._loop)
+        try:
+            return fut.result(timeout=90)
+        except Exception:
+            fut.cancel()
+            return None
+
+
+_PROBE_RUNNER: Optional[_ProbeRunner] = None
+_PROBE_RUNNER_LOCK = threading.Lock()
+
+# Cross-scan counters. Attribute access on a namespace replaces the old
+# per-item globals() dict round-trip; scans accumulate locally and merge
+# under the lock once per batch.
+_stats = types.SimpleNamespace(seen_videos=0)
+_stats_lock = threading.Lock()
+
+
+def probe_ffprobe(path: Path | str) -> Optional[dict]:
+    """Run ffprobe and return the parsed JSON document, or None on failure."""
+    global _PROBE_RUNNER
+    if _PROBE_RUNNER is None:
+        with _PROBE_RUNNER_LOCK:
+            if _PROBE_RUNNER is None:
+                _PROBE_RUNNER = _ProbeRunner()
+    return _PROBE_RUNNER.probe(path)
+
+
+def sample_hash(path: Path | str, algo: str = "sha256",
+                sample: int = 1048576) -> str:
+    """Hash the first, middle and last `sample` bytes of the file.
+
+    Cheap change-detection fingerprint; large files are never read
+    fully. This is a local "has it changed" check, not an integrity
+    hash, so with hash_algo=xxhash64 (and the xxhash wheel installed)
+    the non-cryptographic xxh3 is used — several times faster than
+    sha256 even on SHA-NI hardware.
+    """
+    if algo == "xxhash64" and xxhash is not None:
+        h: Any = xxhash.xxh3_64()
+    elif algo == "blake3" and blake3 is not None:
+        h = blake3()
+    elif algo in hashlib.algorithms_available:
+        h = hashlib.new(algo)
+    else:
+        h = hashlib.sha256()
+    with open(path, "rb", buffering=0) as f:
+        # fstat on the open fd: no second path resolution — the kernel
+        # would otherwise walk every component of the path again.
+        fd = f.fileno()
+        size = os.fstat(fd).st_size
+
+        def _window(off: int, length: int) -> None:
+            # mmap the window and hash straight out of the page cache;
+            # read() would copy the same bytes into userspace first.
+            # Offsets must be allocation-granularity aligned, so map
+            # from the aligned base and slice off the delta.
+            length = min(length, size - off)
+            if length <= 0:
+                return
+            base = off - (off % mmap.ALLOCATIONGRANULARITY)
+            delta = off - base
+            _advise(fd, getattr(os, "POSIX_FADV_WILLNEED", 0),
+                    base, length + delta)
+            try:
+                mm = mmap.mmap(fd, length + delta, offset=base,
+                               access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                f.seek(off)
+                h.update(f.read(length))
+                return
+            try:
+                h.update(memoryview(mm)[delta:delta + length])
+            finally:
+                mm.close()
+
+        _window(0, sample)
+        if size > sample * 2:
+            _window(max(0, size // 2 - sample // 2), sample)
+        if size > sample:
+            _window(max(0, size - sample), sample)
+    return h.hexdigest()
+
+
+def effective_hash_algo(algo: str) -> str:
+    """The algorithm sample_hash/full_hash will actually run for `algo`.
+
+    The optional xxhash/blake3 wheels silently fall back to sha256 when
+    absent; cache rows and ingest payloads must record the fallback, not
+    the configured label — otherwise a host without the wheel reuses (or
+    populates) xxhash64-labelled sha256 digests, and mixed fleets stop
+    matching duplicates across hosts.
+    """
+    if algo == "xxhash64":
+        return algo if xxhash is not None else "sha256"
+    if algo == "blake3":
+        return algo if blake3 is not None else "sha256"
+    return algo if algo in hashlib.algorithms_available else "sha256"
+
+
+def _advise(fd: int, advice: int, offset: int = 0, length: int = 0) -> None:
+    """Best-effort posix_fadvise; a no-op where the call is missing."""
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except (AttributeError, OSError):
+        pass
+
+
+def full_hash(path: Path | str, algo: str = "sha256") -> str:
+    """Hash the whole file.
+
+    On 3.11+ hashlib.file_digest runs the read/update loop in C and
+    releases the GIL for the duration, which is roughly an order of
+    magnitude faster than chunking from Python. With hash_algo=blake3
+    (and the blake3 wheel installed) large files additionally get
+    BLAKE3's internal multithreading, which saturates several cores on
+    a single file instead of relying only on inter-file parallelism.
+
+    Around every read path the kernel is told the access is sequential
+    (bigger readahead) and, once done, that the pages won't be re-read
+    (POSIX_FADV_DONTNEED): hashing terabytes of video must not evict
+    the SQLite cache and directory metadata from the page cache.
+    """
+    if algo == "blake3" and blake3 is not None:
+        h = blake3(max_threads=blake3.AUTO)
+        if hasattr(h, "update_mmap"):
+            # mmap lets the SIMD kernels read the page cache directly:
+            # no read() copies, and the multithreaded C side can split
+            # the mapping across cores.
+            try:
+                h.update_mmap(str(path))
+            except OSError:
+                h = blake3(max_threads=blake3.AUTO)
+            else:
+                try:
+                    fd = os.open(str(path), os.O_RDONLY)
+                except OSError:
+                    pass
+                else:
+                    _advise(fd, getattr(os, "POSIX_FADV_DONTNEED", 0))
+                    os.close(fd)
+                return h.hexdigest()
+        buf = bytearray(1 << 22)
+        mv = memoryview(buf)
+        with open(path, "rb", buffering=0) as f:
+            _advise(f.fileno(), getattr(os, "POSIX_FADV_SEQUENTIAL", 0))
+            while n := f.readinto(buf):
+                h.update(mv[:n])
+            _advise(f.fileno(), getattr(os, "POSIX_FADV_DONTNEED", 0))
+        return h.hexdigest()
+    if algo not in hashlib.algorithms_available:
+        algo = "sha256"
+    if sys.version_info >= (3, 11):
+        with open(path, "rb") as f:
+            _advise(f.fileno(), getattr(os, "POSIX_FADV_SEQUENTIAL", 0))
+            digest = hashlib.file_digest(f, algo).hexdigest()
+            _advise(f.fileno(), getattr(os, "POSIX_FADV_DONTNEED", 0))
+            return digest
+    h = hashlib.new(algo)
+    # 4 MiB blocks: big enough that the GIL release inside update()
+    # dominates the per-iteration Python overhead; readinto into one
+    # reusable buffer keeps allocations O(1) instead of O(size/chunk).
+    buf = bytearray(1 << 22)
+    mv = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        _advise(f.fileno(), getattr(os, "POSIX_FADV_SEQUENTIAL", 0))
+        while n := f.readinto(buf):
+            h.update(mv[:n])
+        _advise(f.fileno(), getattr(os, "POSIX_FADV_DONTNEED", 0))
+    return h.hexdigest()
+
+
+def default_inode_key(st: os.stat_result) -> bytes:
+    """Pack identity+freshness fields into a fixed 40-byte key.
+
+    Stored as a BLOB and compared as one, so a cache-validity check is
+    a memcmp instead of formatting and comparing a ":"-joined string
+    per file. Rows persisted with the old string keys simply miss once
+    and are rehashed.
+    """
+    return struct.pack("<QQQqq", st.st_dev & 0xFFFFFFFFFFFFFFFF,
+                       st.st_ino & 0xFFFFFFFFFFFFFFFF, st.st_size,
+                       st.st_mtime_ns, getattr(st, "st_ctime_ns", 0))
+
+
+def _walk_entries(top: str, follow_links: bool,
+                  cursor: Optional[str] = None) -> Iterator[os.DirEntry]:
+    """Recursive scandir yielding file DirEntry objects in path order.
+
+    DirEntry caches the stat result from the directory read on most
+    platforms, so downstream entry.stat() calls cost no extra syscall.
+
+    Files and subdirectories are interleaved, with directories sorted
+    as name + separator, so the stream comes out in lexicographic
+    order of the full paths ("a.txt" before anything under "a/"). The
+    resume cursor relies on that total order: "path <= cursor" must
+    mean "already scanned", for files the walk hasn't reached yet too.
+
+    With a resume `cursor` (the newest fully delivered path of the
+    previous run), whole subtrees that sort entirely before it are
+    pruned without being scandir'd at all: every path under `sub`
+    shares the `sub + os.sep` prefix, so if that prefix sorts before
+    the cursor and the cursor is not inside the subtree, nothing under
+    it can remain. Resume cost is O(remaining files + tree depth)
+    instead of re-walking and string-comparing the whole root.
+    """
+    def _key(e: os.DirEntry) -> str:
+        try:
+            if e.is_dir(follow_symlinks=follow_links):
+                return e.name + os.sep
+        except OSError:
+            pass
+        return e.name
+
+    try:
+        entries = sorted(os.scandir(top), key=_key)
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir(follow_symlinks=follow_links)
+            is_file = not is_dir and entry.is_file(
+                follow_symlinks=follow_links)
+        except OSError:
+            continue
+        if is_dir:
+            if cursor is not None:
+                prefix = entry.path + os.sep
+                if prefix < cursor and not cursor.startswith(prefix):
+                    continue
+            yield from _walk_entries(entry.path, follow_links, cursor)
+        elif is_file:
+            if cursor is not None and entry.path <= cursor:
+                continue
+            yield entry
+
+
+def iter_media_files(roots: list[Path], video_exts, image_exts, subtitle_exts,
+                     xml_exts, other_exts, junk_patterns, junk_exclude_exts,
+                     follow_links: bool = False,
+                     totals: Optional[dict] = None,
+                     cursor: Optional[str] = None
+                     ) -> Iterator[tuple[str, os.DirEntry, Optional[str]]]:
+    """Yield (kind, dir_entry, junk_pattern) for every file under the roots.
+
+    Classification is precomputed into one {ext: kind} dict and the junk
+    patterns into a single compiled regex, so the per-file cost is one
+    dict lookup plus one regex match instead of five set membership
+    tests and a Python fnmatch loop.
+
+    When `totals` is given, its "files"/"videos" counters are bumped as
+    entries stream out, so callers get progress totals from the same
+    single traversal instead of a separate os.walk pre-count pass.
+    """
+    ext_kind: dict[str, str] = {}
+    for exts, kind in ((video_exts, "video"), (image_exts, "image"),
+                       (subtitle_exts, "subtitle"), (xml_exts, "xml"),
+                       (other_exts, "other")):
+        for ext in exts:
+            ext_kind.setdefault(ext.lower(), kind)
+    junk_re = None
+    if junk_patterns:
+        # Named groups let us recover which pattern matched without
+        # running each one individually.
+        junk_re = re.compile("|".join(
+            "(?P<p%d>%s)" % (i, fnmatch.translate(p.lower()))
+            for i, p in enumerate(junk_patterns)))
+    junk_exclude = frozenset(e.lower() for e in junk_exclude_exts)
+    # The loop body below is deliberately all C-level calls (str.rfind,
+    # dict.get, a compiled regex); bound methods are hoisted so the
+    # interpreter does no attribute lookups per file.
+    kind_for = ext_kind.get
+    if junk_re is None:
+        # Fast path for the common empty-junk_patterns config: no junk
+        # test at all in the per-file loop.
+        for root in roots:
+            for entry in _walk_entries(str(root), follow_links, cursor):
+                lower = entry.name.lower()
+                dot = lower.rfind(".")
+                kind = kind_for(lower[dot:] if dot > 0 else "", "unknown")
+                if totals is not None:
+                    totals["files"] += 1
+                    if kind == "video":
+                        totals["videos"] += 1
+                yield (kind, entry, None)
+        return
+    junk_match = junk_re.match
+    for root in roots:
+        for entry in _walk_entries(str(root), follow_links, cursor):
+            name = entry.name
+            lower = name.lower()
+            dot = lower.rfind(".")
+            ext = lower[dot:] if dot > 0 else ""
+            m = junk_match(lower)
+            if m is not None and ext not in junk_exclude:
+                kind = "junk"
+                pat: Optional[str] = junk_patterns[int(m.lastgroup[1:])]
+            else:
+                kind = kind_for(ext, "unknown")
+                pat = None
+            if totals is not None:
+                totals["files"] += 1
+                if kind == "video":
+                    totals["videos"] += 1
+            yield (kind, entry, pat)
+
+
+class _SpinSemaphore:
+    """Counting semaphore that spins briefly before parking in the kernel.
+
+    During a healthy scan a permit is nearly always available, so
+    acquire() first retries a GIL-protected decrement a few dozen times
+    (yielding the GIL between tries) and only falls back to blocking on
+    an Event when the limit is truly exhausted. threading.Semaphore
+    takes the condition-variable slow path on every contended acquire;
+    this keeps the common case free of kernel waits.
+    """
+
+    def __init__(self, value: int):
+        self._lock = threading.Lock()
+        self._count = value
+        self._event = threading.Event()
+
+    def acquire(self, blocking: bool = True) -> bool:
+        for _ in range(50):
+            with self._lock:
+                if self._count > 0:
+                    self._count -= 1
+                    return True
+            if not blocking:
+                return False
+            time.sleep(0)
+        while True:
+            self._event.wait()
+            with self._lock:
+                if self._count > 0:
+                    self._count -= 1
+                    if self._count == 0:
+                        self._event.clear()
+                    return True
+                self._event.clear()
+
+    def release(self) -> None:
+        with self._lock:
+            self._count += 1
+        self._event.set()
+
+
+_UNSET: Any = object()
+
+
+def build_item(entry: os.DirEntry, kind: str, cfg: dict,
+               writer: agent_cache.CacheWriter,
+               reader: sqlite3.Connection,
+               do_hashes: bool = True, do_probe: bool = True,
+               row: Any = _UNSET) -> Item:
+    """Build the ingest payload for one file, consulting the local cache.
+
+    `entry` is the DirEntry from the walk; its stat() returns the result
+    cached during the directory read, so no extra stat syscall is paid
+    here. Lookups go to `reader`; cache writes are enqueued on `writer`
+    and committed in batched transactions by its thread — writing per
+    file would make the scan fsync-bound (SQLite manages ~60 synchronous
+    commits/sec on rotating disks).
+    """
+    ac = agent_cache
+    st = entry.stat(follow_symlinks=bool(cfg.get("follow_links", False)))
+    sp = entry.path
+    item = Item(path=sp, kind=kind, size=st.st_size, mtime=st.st_mtime)
+    inode_key = default_inode_key(st)
+    # Resolve the configured algorithm to the one the helpers will
+    # actually run, so cache rows and payloads are labelled truthfully
+    # and a cache entry written with the real xxhash64/blake3 is
+    # rehashed (not reused) on a host where the wheel is missing.
+    algo = effective_hash_algo(cfg.get("hash_algo", "sha256"))
+    sample = int(cfg.get("sample_size", 1048576))
+    if row is _UNSET:
+        row = ac.get(reader, sp)
+    now = time.time()
+    if not (row is not None and row[1] == kind and row[4] == inode_key
+            and row[12] is not None and now - row[12] < 86400.0):
+        # Refresh the index row only when something changed (or the
+        # last_seen stamp is a day old): on an incremental rescan the
+        # overwhelming majority of files are byte-identical, and
+        # skipping their upserts keeps the writer queue near-empty so
+        # the whole pass is bound by readdir+stat, not SQLite.
+        writer.put("seen", (sp, kind, st.st_size, st.st_mtime,
+                            inode_key, now))
+    if do_hashes and kind != "junk":
+        ok, cached = ac.valid_hash_cached(row, inode_key, algo, sample)
+        if ok:
+            item.hashes = HashInfo(**cached)
+        else:
+            s_hash = sample_hash(sp, algo, sample)
+            f_hash = None
+            if st.st_size <= int(cfg.get("full_hash_max_bytes", 0)):
+                f_hash = full_hash(sp, algo)
+            item.hashes = HashInfo(algo=algo, sample_size=sample,
+                                   sample_hash=s_hash, full_hash=f_hash)
+            writer.put("hashes", (algo, sample, s_hash, f_hash,
+                                  time.time(), sp))
+    if do_probe and kind == "video" and has_ffprobe():
+        if ac.valid_probe_cached(row, inode_key):
+            item.probe = json.loads(row[11])
+        else:
+            probe = probe_ffprobe(sp)
+            if probe is not None:
+                item.probe = probe
+                writer.put("probed", (json.dumps(probe), time.time(),
+                                      sp))
+    return item
+
+
+def _iter_gzip_json(payload: dict) -> Iterator[bytes]:
+    """Incrementally encode payload as gzip'd JSON in ~64 KiB pieces.
+
+    JSONEncoder.iterencode feeds text fragments straight into the gzip
+    stream, so the raw JSON of a multi-MB batch never has to coexist
+    with its compressed form — peak memory during a flush is the
+    compressed body plus one chunk. Level 1 is ~5x faster than the
+    stdlib default (9) and nearly as small for JSON.
+    """
+    buf = io.BytesIO()
+    gz = gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=1)
+    if orjson is not None:
+        # orjson serializes the whole payload in one C pass, ~5-10x
+        # faster than iterencode; its output is fed to gzip in slices
+        # so raw and compressed never coexist in full.
+        mv = memoryview(orjson.dumps(payload))
+        for i in range(0, len(mv), 1 << 16):
+            gz.write(mv[i:i + (1 << 16)])
+            if buf.tell() > (1 << 16):
+                yield buf.getvalue()
+                buf.seek(0)
+                buf.truncate()
+        gz.close()
+        yield buf.getvalue()
+        return
+    for chunk in json.JSONEncoder(default=_json_default).iterencode(payload):
+        gz.write(chunk.encode("utf-8"))
+        if buf.tell() > (1 << 16):
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    gz.close()
+    yield buf.getvalue()
+
+
+def post_batch(server_base: str, batch_id: str, items: list[Item],
+               writer: agent_cache.CacheWriter, use_gzip: bool = True) -> int:
+    """POST one batch to the server; on failure park it in the outbox."""
+    payload = {"batch_id": batch_id, "items": items}
+    headers = {"Content-Type": "application/json"}
+    body: Any
+    if use_gzip:
+        headers["Content-Encoding"] = "gzip"
+        # Joined into one bytes object so requests sends a plain
+        # Content-Length body; handing it the generator makes the POST
+        # go out Transfer-Encoding: chunked, which the ingest server's
+        # Content-Length read treats as an empty request.
+        body = b"".join(_iter_gzip_json(payload))
+    else:
+        body = _dumps_bytes(payload)
+    try:
+        r = _SESSION.post(server_base + "/ingest/batch", data=body,
+                          headers=headers, timeout=30)
+        r.raise_for_status()
+        return len(items)
+    except Exception:
+        # Serialized only on the failure path: stored as the plain
+        # request body so the drain can POST it verbatim later.
+        writer.put("outbox", (batch_id, sqlite3.Binary(_dumps_bytes(payload)),
+                              time.time()))
+        return 0
+
+
+def drain_outbox(writer: agent_cache.CacheWriter, server_base: str) -> int:
+    """Retry batches that previously failed to send.
+
+    Runs on the main thread between scan passes, after writer.flush(),
+    so reading the writer's connection here never races a batch commit.
+    """
+    sent = 0
+    for row_id, batch_id, payload in agent_cache.list_outbox(writer.conn):
+        if isinstance(payload, str):  # rows from before the bytes change
+            payload = payload.encode("utf-8")
+        try:
+            r = _SESSION.post(server_base + "/ingest/batch", data=payload,
+                              headers={"Content-Type": "application/json"},
+                              timeout=30)
+            r.raise_for_status()
+        except Exception:
+            break
+        writer.put("delete_outbox", (row_id,))
+        sent += 1
+    writer.flush()
+    return sent
+
+
+def scan_root_with_resume(root: Path, cfg: dict,
+                          writer: agent_cache.CacheWriter,
+                          phase: Optional[str] = None, do_hashes: bool = True,
+                          do_probe: bool = True,
+                          only_kinds: Optional[set] = None,
+                          totals: Optional[dict] = None) -> int:
+    """Scan one root, resuming from the persisted cursor if present."""
+    ac = agent_cache
+    if phase is None:
+        phase = "scan" if do_hashes and do_probe else (
+            "hashes" if do_hashes else "ffprobe")
+    batch: list[Item] = []
+    batch_id = uuid.uuid4().hex
+    processed = 0
+    server_base = cfg["server_base"]
+    use_gzip = bool(cfg.get("use_gzip", True))
+    batch_size = int(cfg.get("batch_size", 500))
+    agent_workers = int(cfg.get("agent_max_workers") or (os.cpu_count() or 4))
+    if do_probe and not do_hashes:
+        # The probe phase is bound by subprocess startup and ffprobe
+        # I/O rather than hashing throughput, so it gets its own width.
+        agent_workers = min(8, os.cpu_count() or 4)
+    # Hashing happens in C with the GIL released, so threads genuinely
+    # parallelize the hash-bound phase. The semaphore bounds in-flight
+    # work; the limit is nudged up when the backlog stays low.
+    pool = ThreadPoolExecutor(max_workers=agent_workers)
+    current_limit = agent_workers * 2
+    permits = _SpinSemaphore(current_limit)
+    started = time.time()
+    # Concurrency controller state: an EWMA of the blocking ratio
+    # (submit time spent waiting on a permit vs worker time spent in
+    # build_item). High ratio with a real backlog means the limit is
+    # the bottleneck; a near-zero ratio means permits are going spare.
+    tune_lock = threading.Lock()
+    wait_s = 0.0
+    work_s = 0.0
+    beta_ewma = 0.0
+    c_up = 0
+    last_tune = time.monotonic()
+    # All cache reads go through a read-only connection so lookups from
+    # worker threads never contend with the writer thread's batch
+    # commits.
+    try:
+        reader = ac.connect_reader(Path(cfg["cache_db"]))
+    except sqlite3.Error:
+        reader = writer.conn
+    cursor_path = ac.load_progress(reader, str(root), phase)
+
+    # Resume bookkeeping. Batches fill in completion order, so the
+    # last item of a delivered batch may sit far ahead of older files
+    # still being hashed or waiting in a later batch — persisting it
+    # would skip those files on resume. `inflight` keeps submitted
+    # paths in walk (= lexicographic) order; a path leaves the front
+    # only once delivered, so everything popped off the front is the
+    # fully delivered prefix of the walk and its newest path is the
+    # only cursor that is safe to persist.
+    inflight: deque = deque()
+    done_paths: set[str] = set()
+    cursor_lock = threading.Lock()
+
+    def _mark_done(path: str) -> Optional[str]:
+        """Record one delivered path; return the current watermark."""
+        with cursor_lock:
+            done_paths.add(path)
+            mark = None
+            while inflight and inflight[0] in done_paths:
+                mark = inflight.popleft()
+                done_paths.discard(mark)
+            return mark
+
+    # Uploads run on their own thread so a slow HTTP round-trip stalls
+    # neither hashing nor the walk. The bounded queue is the
+    # backpressure: at most 4 batches are ever in flight, so memory
+    # stays O(4 * batch_size) instead of growing with network latency,
+    # and the tuner no longer mistakes RTT for a CPU backlog.
+    upload_q: queue.Queue = queue.Queue(maxsize=4)
+
+    def _uploader() -> None:
+        nonlocal processed
+        while True:
+            job = upload_q.get()
+            if job is None:
+                upload_q.task_done()
+                return
+            bid, items = job
+            sent = post_batch(server_base, bid, items, writer, use_gzip)
+            processed += sent
+            if sent:
+                # At most one cursor write per delivered batch (the
+                # writer additionally collapses queued cursors to the
+                # latest per (root, phase) before committing), and only
+                # when the fully delivered prefix of the walk advanced.
+                # A failed batch marks nothing: it sits in the outbox
+                # and a resume rescans its files, which the idempotent
+                # upserts absorb.
+                mark = None
+                for it in items:
+                    mark = _mark_done(it.path) or mark
+                if mark is not None:
+                    writer.put("progress", (str(root), phase, mark,
+                                            time.time()))
+            upload_q.task_done()
+
+    uploader = threading.Thread(target=_uploader, name="agent-uploader",
+                                daemon=True)
+    uploader.start()
+
+    # Completed items come back through a queue rather than a futures
+    # list: no per-iteration "which are done" scan and no O(n) remove(),
+    # and nothing retains a reference to every future for the lifetime
+    # of the scan. A permit is held until the result is parked here, so
+    # the semaphore bounds live results as well as in-flight builds;
+    # the maxsize is a hard stop should draining ever fall behind.
+    results_q: queue.Queue = queue.Queue(maxsize=agent_workers * 4)
+    submitted = 0
+    drained = 0
+
+    def _job(entry: os.DirEntry, kind: str, row: Any) -> None:
+        nonlocal work_s
+        t0 = time.monotonic()
+        # Every submitted job must park exactly one result: the drain
+        # loop counts them against `submitted`, so a swallowed
+        # exception here would leave it waiting forever. OSError is
+        # routine (file vanished mid-scan); anything else — say a
+        # corrupt cached probe_json or a stale-schema cache row — is
+        # logged and still parks the None sentinel.
+        try:
+            try:
+                item: Optional[Item] = build_item(
+                    entry, kind, cfg, writer, reader,
+                    do_hashes=do_hashes, do_probe=do_probe, row=row)
+            except OSError:
+                item = None
+            except Exception as exc:
+                print("agent: item build failed for %s: %s"
+                      % (entry.path, exc), file=sys.stderr)
+                item = None
+            if item is None:
+                # Nothing will be uploaded for this path, so it must
+                # not hold the resume watermark back.
+                _mark_done(entry.path)
+            dt = time.monotonic() - t0
+            with tune_lock:
+                work_s += dt
+            results_q.put(item)
+        finally:
+            permits.release()
+
+    seen_videos = 0
+
+    def _collect(item: Optional[Item]) -> None:
+        nonlocal batch, batch_id, seen_videos
+        if item is None:
+            return
+        if item.kind == "video":
+            # Plain local increment on the drain thread; merged into
+            # the shared namespace once per batch below.
+            seen_videos += 1
+        batch.append(item)
+        if len(batch) >= batch_size:
+            # Hand the list itself over and start a fresh one; the
+            # uploader and the scan loop never alias a batch.
+            upload_q.put((batch_id, batch))
+            batch = []
+            batch_id = uuid.uuid4().hex
+            with _stats_lock:
+                _stats.seen_videos += seen_videos
+            seen_videos = 0
+
+    def _drain_ready() -> None:
+        nonlocal drained
+        while True:
+            try:
+                item = results_q.get_nowait()
+            except queue.Empty:
+                return
+            drained += 1
+            _collect(item)
+
+    pending: list[tuple[str, os.DirEntry]] = []
+
+    def _tune() -> None:
+        nonlocal last_tune, beta_ewma, wait_s, work_s, c_up, current_limit
+        now = time.monotonic()
+        if now - last_tune < 1.0:
+            return
+        last_tune = now
+        with tune_lock:
+            sample = wait_s / work_s if work_s > 0 else 0.0
+            wait_s = work_s = 0.0
+        beta_ewma = 0.3 * sample + 0.7 * beta_ewma
+        if beta_ewma > 0.2 and submitted - drained > 0:
+            # Hysteresis: three consecutive hot intervals before
+            # widening, so a single slow file doesn't start a hunt.
+            c_up += 1
+            # Capped below the results queue size so every permit
+            # holder can always park its result without blocking.
+            if c_up >= 3 and current_limit < agent_workers * 4:
+                current_limit += 1
+                permits.release()
+                c_up = 0
+        else:
+            c_up = 0
+            if beta_ewma < 0.05 and current_limit > agent_workers:
+                # Shrink by swallowing a permit; in-flight work keeps
+                # the permits it already holds.
+                if permits.acquire(blocking=False):
+                    current_limit -= 1
+
+    def _submit_pending() -> None:
+        nonlocal submitted, wait_s
+        # One IN(...) query replaces a point SELECT per file: the
+        # parse/plan and B-tree descend cost is paid once per chunk.
+        rows = ac.get_many(reader, [e.path for _, e in pending])
+        # Registered before submission, one lock round per chunk: a
+        # worker can finish (and _mark_done) the moment it is
+        # submitted, so its path must already be in walk order here.
+        with cursor_lock:
+            inflight.extend(e.path for _, e in pending)
+        # Bound-method aliases: no attribute lookups inside the
+        # per-file loop.
+        monotonic = time.monotonic
+        acquire = permits.acquire
+        submit = pool.submit
+        row_for = rows.get
+        for kind, entry in pending:
+            t0 = monotonic()
+            acquire()
+            waited = monotonic() - t0
+            with tune_lock:
+                wait_s += waited
+            submit(_job, entry, kind, row_for(entry.path))
+            submitted += 1
+            _drain_ready()
+            _tune()
+        pending.clear()
+
+    pending_append = pending.append
+    for kind, entry, pat in iter_media_files(
+            [root], cfg["video_exts"], cfg["image_exts"],
+            cfg["subtitle_exts"], cfg["xml_exts"], cfg["other_exts"],
+            cfg["junk_patterns"], cfg["junk_exclude_exts"],
+            follow_links=cfg["follow_links"], totals=totals,
+            cursor=cursor_path):
+        if only_kinds is not None and kind not in only_kinds:
+            continue
+        pending_append((kind, entry))
+        if len(pending) >= 256:
+            _submit_pending()
+    _submit_pending()
+    while drained < submitted:
+        item = results_q.get()
+        drained += 1
+        _collect(item)
+    with _stats_lock:
+        _stats.seen_videos += seen_videos
+    seen_videos = 0
+    pool.shutdown(wait=True)
+    if reader is not writer.conn:
+        reader.close()
+    if batch:
+        upload_q.put((batch_id, batch))
+    upload_q.join()
+    upload_q.put(None)
+    uploader.join()
+    elapsed = time.time() - started
+    print(f"scan {root} [{phase}]: {processed} items in {elapsed:.1f}s")
+    writer.put("clear_progress", (str(root), phase))
+    writer.flush()
+    return processed
+
+
+class _ChangeWatcher:
+    """inotify-backed wakeups for the idle loop (Linux only).
+
+    One watch per directory under the roots; events name the directory
+    that changed, so the loop can rescan just those instead of walking
+    every root on a timer. New directories are watched as their create
+    events arrive. Falls back to plain sleep when inotify_simple is not
+    installed (see main()).
+    """
+
+    def __init__(self, roots: list[str]):
+        self.roots = roots
+        self._inotify = inotify_simple.INotify()
+        self._flags = (inotify_simple.flags.CREATE
+                       | inotify_simple.flags.MOVED_TO
+                       | inotify_simple.flags.CLOSE_WRITE)
+        self._wd_dir: dict[int, str] = {}
+        for root in roots:
+            self._watch(root)
+            for dirpath, dirnames, _ in os.walk(root):
+                for d in dirnames:
+                    self._watch(os.path.join(dirpath, d))
+
+    def _watch(self, d: str) -> None:
+        try:
+            wd = self._inotify.add_watch(d, self._flags)
+        except OSError:
+            return
+        self._wd_dir[wd] = d
+
+    def wait(self, timeout_secs: float) -> Optional[set[str]]:
+        """Block until something changes; None on timeout.
+
+        After the first event, keeps draining for another second so a
+        burst (a download finishing, a season being copied in) becomes
+        one targeted rescan instead of many.
+        """
+        events = self._inotify.read(timeout=int(timeout_secs * 1000))
+        if not events:
+            return None
+        events += self._inotify.read(timeout=1000)
+        changed: set[str] = set()
+        isdir = inotify_simple.flags.ISDIR
+        for ev in events:
+            d = self._wd_dir.get(ev.wd)
+            if d is None:
+                continue
+            changed.add(d)
+            if ev.mask & isdir and ev.name:
+                self._watch(os.path.join(d, ev.name))
+        return changed
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Media library scan agent")
+    ap.add_argument("--config", help="path to agent config JSON")
+    ap.add_argument("--once", action="store_true",
+                    help="run a single scan pass and exit")
+    args = ap.parse_args(argv)
+    cfg = load_config(args.config)
+    conn = agent_cache.connect(Path(cfg["cache_db"]))
+    writer = agent_cache.CacheWriter(conn)
+    writer.start()
+    watcher: Optional[_ChangeWatcher] = None
+    changed_dirs: Optional[set] = None
+    while True:
+        try:
+            cfg.update(fetch_config(cfg["server_base"]))
+        except Exception:
+            pass
+        roots_list = [Path(r) for r in cfg["roots"] if os.path.isdir(r)]
+        # Totals accumulate during the scan itself: a growing lower
+        # bound in the logs instead of a second full pre-count
+        # traversal of every root.
+        totals = {"files": 0, "videos": 0}
+        processed = 0
+        # Targeted pass when inotify told us exactly where things
+        # changed; full fused pass otherwise (startup, timeout backstop
+        # or no inotify support). Either way hashing is kind-agnostic
+        # and probing is gated on kind == "video" inside build_item.
+        scan_tops = (sorted(changed_dirs) if changed_dirs
+                     else [str(r) for r in roots_list])
+        for top in scan_tops:
+            processed += scan_root_with_resume(
+                Path(top), cfg, writer, phase="scan", do_hashes=True,
+                do_probe=True, totals=totals)
+        print(f"scan pass: {totals['files']} files, "
+              f"{totals['videos']} videos")
+        drain_outbox(writer, cfg["server_base"])
+        if args.once:
+            writer.close()
+            return 0
+        sleep_secs = int(cfg.get("sleep_secs", 300))
+        timeout = sleep_secs if processed else min(60, sleep_secs)
+        changed_dirs = None
+        if inotify_simple is not None:
+            roots = [str(r) for r in roots_list]
+            if watcher is None or watcher.roots != roots:
+                watcher = _ChangeWatcher(roots)
+            # Wakes the moment the kernel reports a change; a timeout
+            # still triggers the periodic full rescan as a backstop.
+            changed_dirs = watcher.wait(timeout)
+        else:
+            time.sleep(timeout)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
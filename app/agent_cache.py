@@ -0,0 +1,279 @@
+"""Embedded SQLite cache for the scan agent.
+
+Remembers what has been hashed/probed so unchanged files are skipped,
+persists the resume cursor per (root, phase), and holds the outbox of
+undelivered batches. All writes funnel through a single CacheWriter
+thread that commits them in batches; readers use their own read-only
+connections and never contend with it.
+"""
+
+from __future__ import annotations
+
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS agent_index(
+    path TEXT PRIMARY KEY,
+    kind TEXT,
+    size INTEGER,
+    mtime REAL,
+    inode_key TEXT,
+    hash_algo TEXT,
+    sample_size INTEGER,
+    sample_hash TEXT,
+    full_hash TEXT,
+    hashed_at REAL,
+    probed_at REAL,
+    probe_json TEXT,
+    last_seen REAL
+);
+CREATE TABLE IF NOT EXISTS outbox(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    batch_id TEXT,
+    payload_json TEXT,
+    created_at REAL
+);
+CREATE TABLE IF NOT EXISTS scan_progress(
+    root TEXT,
+    phase TEXT,
+    cursor_path TEXT,
+    updated_at REAL,
+    PRIMARY KEY(root, phase)
+);
+"""
+
+# SQL lives in module-lifetime constants so every call binds the same
+# string object and pysqlite's per-connection statement cache hits
+# instead of re-parsing/re-planning.
+GET_SQL = "SELECT * FROM agent_index WHERE path=?"
+UPSERT_SEEN_SQL = (
+    "INSERT INTO agent_index(path, kind, size, mtime, inode_key, last_seen) "
+    "VALUES(?,?,?,?,?,?) "
+    "ON CONFLICT(path) DO UPDATE SET kind=excluded.kind, "
+    "size=excluded.size, mtime=excluded.mtime, "
+    "inode_key=excluded.inode_key, last_seen=excluded.last_seen")
+SAVE_HASHES_SQL = (
+    "UPDATE agent_index SET hash_algo=?, sample_size=?, sample_hash=?, "
+    "full_hash=?, hashed_at=? WHERE path=?")
+MARK_PROBED_SQL = (
+    "UPDATE agent_index SET probe_json=?, probed_at=? WHERE path=?")
+SAVE_PROGRESS_SQL = (
+    "INSERT INTO scan_progress(root, phase, cursor_path, updated_at) "
+    "VALUES(?,?,?,?) "
+    "ON CONFLICT(root, phase) DO UPDATE SET "
+    "cursor_path=excluded.cursor_path, updated_at=excluded.updated_at")
+ENQUEUE_OUTBOX_SQL = (
+    "INSERT INTO outbox(batch_id, payload_json, created_at) VALUES(?,?,?)")
+
+
+def connect(db_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(db_path), isolation_level=None,
+                           check_same_thread=False, cached_statements=256)
+    conn.executescript(SCHEMA)
+    # WAL + synchronous=NORMAL turns each commit into a WAL append
+    # instead of a full fsync'd journal rewrite; the CacheWriter batches
+    # writes into one transaction per flush, so this is what keeps a
+    # 100k-file pass from being fsync-bound.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA mmap_size=268435456")
+    return conn
+
+
+def connect_reader(db_path: Path) -> sqlite3.Connection:
+    """Open a read-only connection for lookups from worker threads.
+
+    Under WAL, readers on their own connection never block on (or get
+    blocked by) the writer; sharing the writer connection from workers
+    serializes every get() behind in-flight transactions.
+    """
+    conn = sqlite3.connect("file:%s?mode=ro" % db_path, uri=True,
+                           check_same_thread=False)
+    conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+def get(conn: sqlite3.Connection, path: Path | str) -> Optional[tuple]:
+    cur = conn.execute(GET_SQL, (str(path),))
+    return cur.fetchone()
+
+
+def get_many(conn: sqlite3.Connection, paths: list[str]) -> dict[str, tuple]:
+    """Fetch rows for many paths with one B-tree probe batch each.
+
+    Chunked to stay under SQLite's bound-parameter limit.
+    """
+    rows: dict[str, tuple] = {}
+    for i in range(0, len(paths), 500):
+        chunk = paths[i:i + 500]
+        cur = conn.execute(
+            "SELECT * FROM agent_index WHERE path IN (%s)"
+            % ",".join("?" * len(chunk)), chunk)
+        for r in cur:
+            rows[r[0]] = r
+    return rows
+
+
+def valid_hash_cached(row: Optional[tuple], inode_key: bytes, algo: str,
+                      sample: int) -> tuple[bool, Optional[dict]]:
+    """Return (hit, hashes-dict) when the cached row still matches."""
+    if row is None:
+        return False, None
+    if row[4] != inode_key or row[5] != algo or row[6] != sample:
+        return False, None
+    if row[7] is None:
+        return False, None
+    return True, {"algo": row[5], "sample_size": row[6],
+                  "sample_hash": row[7], "full_hash": row[8]}
+
+
+def valid_probe_cached(row: Optional[tuple], inode_key: bytes) -> bool:
+    if row is None or row[11] is None:
+        return False
+    return row[4] == inode_key
+
+
+def load_progress(conn: sqlite3.Connection, root: str,
+                  phase: str) -> Optional[str]:
+    cur = conn.execute(
+        "SELECT cursor_path FROM scan_progress WHERE root=? AND phase=?",
+        (root, phase))
+    row = cur.fetchone()
+    return row[0] if row else None
+
+
+def list_outbox(conn: sqlite3.Connection, limit: int = 50) -> list[tuple]:
+    cur = conn.execute(
+        "SELECT id, batch_id, payload_json FROM outbox ORDER BY id LIMIT ?",
+        (limit,))
+    return cur.fetchall()
+
+
+def delete_outbox(conn: sqlite3.Connection, row_id: int) -> None:
+    conn.execute("DELETE FROM outbox WHERE id=?", (row_id,))
+
+
+def delete_outbox_many(conn: sqlite3.Connection, ids: list[int]) -> None:
+    """Delete many delivered outbox rows in one statement per chunk.
+
+    Chunked to stay under SQLite's bound-parameter limit, like get_many.
+    """
+    for i in range(0, len(ids), 500):
+        chunk = ids[i:i + 500]
+        conn.execute("DELETE FROM outbox WHERE id IN (%s)"
+                     % ",".join("?" * len(chunk)), chunk)
+
+
+_CLOSE = object()
+
+
+class CacheWriter(threading.Thread):
+    """Single writer thread draining queued cache mutations in batches.
+
+    Producers (scan workers and the batch loop) enqueue ("seen" |
+    "hashes" | "probed" | "outbox" | "delete_outbox" | "progress" |
+    "clear_progress", row) pairs; the thread commits up to 500 per BEGIN
+    IMMEDIATE transaction, or whatever has queued after a second of
+    quiet. Only the latest progress cursor per (root, phase) survives a
+    batch, so cursor spam collapses to one UPSERT.
+    """
+
+    BATCH_LIMIT = 500
+
+    def __init__(self, conn: sqlite3.Connection):
+        super().__init__(name="agent-cache-writer", daemon=True)
+        self.conn = conn
+        self._q: queue.Queue = queue.Queue()
+
+    def put(self, kind: str, row: tuple) -> None:
+        self._q.put((kind, row))
+
+    def flush(self) -> None:
+        """Block until everything queued so far has been committed."""
+        self._q.join()
+
+    def close(self) -> None:
+        self._q.put(_CLOSE)
+        self.join()
+
+    def run(self) -> None:
+        while True:
+            try:
+                op = self._q.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            ops = [op]
+            while len(ops) < self.BATCH_LIMIT:
+                try:
+                    ops.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            closing = ops[-1] is _CLOSE
+            if closing:
+                ops.pop()
+            if ops:
+                try:
+                    self._apply(ops)
+                except sqlite3.Error as exc:
+                    print("agent cache write failed: %s" % exc,
+                          file=sys.stderr)
+            for _ in range(len(ops) + (1 if closing else 0)):
+                self._q.task_done()
+            if closing:
+                return
+
+    def _apply(self, ops: list[tuple]) -> None:
+        seen: list[tuple] = []
+        hashes: list[tuple] = []
+        probed: list[tuple] = []
+        outbox: list[tuple] = []
+        outbox_deletes: list[tuple] = []
+        progress: dict[tuple, tuple] = {}
+        clears: list[tuple] = []
+        for kind, row in ops:
+            if kind == "seen":
+                seen.append(row)
+            elif kind == "hashes":
+                hashes.append(row)
+            elif kind == "probed":
+                probed.append(row)
+            elif kind == "outbox":
+                outbox.append(row)
+            elif kind == "delete_outbox":
+                outbox_deletes.append(row)
+            elif kind == "progress":
+                progress[(row[0], row[1])] = row
+            elif kind == "clear_progress":
+                clears.append(row)
+        conn = self.conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if seen:
+                conn.executemany(UPSERT_SEEN_SQL, seen)
+            if hashes:
+                conn.executemany(SAVE_HASHES_SQL, hashes)
+            if probed:
+                conn.executemany(MARK_PROBED_SQL, probed)
+            if outbox:
+                conn.executemany(ENQUEUE_OUTBOX_SQL, outbox)
+            if outbox_deletes:
+                delete_outbox_many(conn, [row[0]
+                                          for row in outbox_deletes])
+            for row in progress.values():
+                conn.execute(SAVE_PROGRESS_SQL, row)
+            if clears:
+                conn.executemany(
+                    "DELETE FROM scan_progress WHERE root=? AND phase=?",
+                    clears)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
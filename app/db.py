@@ -0,0 +1,1190 @@
+"""Library database for the GUI/server side.
+
+Holds the indexed files, their hashes and probed metadata, junk
+candidates flagged by the scan, and an operations log for everything
+the organizer/deleter does. Plain module-level helpers over sqlite3,
+one connection per component.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import hashlib
+import os
+import queue
+import sqlite3
+import sys
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import Iterator, Optional
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roots(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT UNIQUE NOT NULL,
+    enabled INTEGER NOT NULL DEFAULT 1,
+    added_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_roots_enabled
+    ON roots(path) WHERE enabled=1;
+CREATE TABLE IF NOT EXISTS files(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT UNIQUE NOT NULL,
+    kind TEXT,
+    size INTEGER,
+    mtime REAL,
+    first_seen REAL,
+    last_seen REAL,
+    path_hash INTEGER,
+    root_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS hashes(
+    file_id INTEGER PRIMARY KEY REFERENCES files(id) ON DELETE CASCADE,
+    algo TEXT,
+    sample_size INTEGER,
+    sample_hash TEXT,
+    full_hash TEXT,
+    hashed_at REAL,
+    group_key TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_hashes_fullhash
+    ON hashes(full_hash) WHERE full_hash IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_hashes_group
+    ON hashes(full_hash, sample_hash, file_id);
+CREATE INDEX IF NOT EXISTS idx_hashes_sample_size
+    ON hashes(sample_hash, file_id);
+CREATE TABLE IF NOT EXISTS media_metadata(
+    file_id INTEGER PRIMARY KEY REFERENCES files(id) ON DELETE CASCADE,
+    duration REAL,
+    width INTEGER,
+    height INTEGER,
+    video_codec TEXT,
+    audio_codec TEXT,
+    container TEXT,
+    probed_at REAL,
+    streams_zst BLOB
+);
+CREATE TABLE IF NOT EXISTS junk_candidates(
+    path TEXT PRIMARY KEY,
+    size INTEGER,
+    mtime REAL,
+    ext TEXT,
+    reason TEXT,
+    seen_at REAL,
+    path_hash INTEGER
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_junk_path
+    ON junk_candidates(path COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS operations_log(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    op TEXT,
+    src TEXT,
+    dst TEXT,
+    detail TEXT,
+    at REAL
+);
+"""
+
+# SQL lives in module-lifetime constants so every call binds the same
+# string object and pysqlite's per-connection statement cache hits
+# instead of re-parsing/re-planning (same pattern as app.agent_cache).
+# root_id is resolved at insert against the (tiny) roots table —
+# longest matching root wins — so per-root counts become an equality
+# probe instead of a path range walk.
+ROOT_ID_EXPR = (
+    "(SELECT id FROM roots "
+    "WHERE substr(?1, 1, length(path) + 1) = path || '/' "
+    "ORDER BY length(path) DESC LIMIT 1)")
+UPSERT_FILES_SQL = (
+    "INSERT INTO files(path, kind, size, mtime, first_seen, last_seen, "
+    "path_hash, root_id) VALUES(?1,?2,?3,?4,?5,?6, pathhash(?1), "
+    + ROOT_ID_EXPR + ") "
+    "ON CONFLICT(path) DO UPDATE SET kind=excluded.kind, "
+    "size=excluded.size, mtime=excluded.mtime, "
+    "last_seen=excluded.last_seen, root_id=excluded.root_id")
+UPSERT_FILE_RETURNING_SQL = UPSERT_FILES_SQL + " RETURNING id"
+UPSERT_FILE_RETURNING_PATH_SQL = UPSERT_FILES_SQL + " RETURNING id, path"
+GET_FILE_ID_SQL = "SELECT id FROM files WHERE path_hash=? AND path=?"
+GET_FILE_SQL = "SELECT * FROM files WHERE path_hash=? AND path=?"
+# group_key is materialized at upsert time (full-hash groups as
+# 'F:<hash>', sample groups as 'S:<hash>:<size>') so duplicate sweeps
+# read an indexed column instead of concatenating strings per row.
+GROUP_KEY_EXPR = (
+    "CASE WHEN ?5 IS NOT NULL THEN 'F:' || ?5 "
+    "WHEN ?4 IS NOT NULL THEN 'S:' || ?4 || ':' || "
+    "(SELECT size FROM files WHERE id=?1) END")
+UPSERT_HASHES_SQL = (
+    "INSERT INTO hashes(file_id, algo, sample_size, sample_hash, "
+    "full_hash, hashed_at, group_key) VALUES(?1,?2,?3,?4,?5,?6, "
+    + GROUP_KEY_EXPR + ") "
+    "ON CONFLICT(file_id) DO UPDATE SET algo=excluded.algo, "
+    "sample_size=excluded.sample_size, "
+    "sample_hash=excluded.sample_hash, full_hash=excluded.full_hash, "
+    "hashed_at=excluded.hashed_at, group_key=excluded.group_key")
+GET_HASH_SQL = "SELECT * FROM hashes WHERE file_id=?"
+UPSERT_METADATA_SQL = (
+    "INSERT INTO media_metadata(file_id, duration, width, height, "
+    "video_codec, audio_codec, container, probed_at, streams_zst) "
+    "VALUES(?,?,?,?,?,?,?,?,?) "
+    "ON CONFLICT(file_id) DO UPDATE SET duration=excluded.duration, "
+    "width=excluded.width, height=excluded.height, "
+    "video_codec=excluded.video_codec, "
+    "audio_codec=excluded.audio_codec, container=excluded.container, "
+    "probed_at=excluded.probed_at, streams_zst=excluded.streams_zst")
+GET_STREAMS_SQL = "SELECT streams_zst FROM media_metadata WHERE file_id=?"
+UPSERT_JUNK_SQL = (
+    "INSERT INTO junk_candidates(path, size, mtime, ext, reason, seen_at, "
+    "path_hash) VALUES(?1,?2,?3,?4,?5,?6, pathhash(?1)) "
+    "ON CONFLICT(path) DO UPDATE SET size=excluded.size, "
+    "mtime=excluded.mtime, ext=excluded.ext, reason=excluded.reason, "
+    "seen_at=excluded.seen_at")
+# Leading column is the basename (text after the last '/'; paths are
+# stored in POSIX form) computed in SQL, so the GUI never builds a
+# pathlib.Path per row just to display the file name.
+LIST_JUNK_SQL = (
+    "SELECT replace(path, rtrim(path, replace(path, '/', '')), '') "
+    "       AS name, "
+    "path, size, mtime, ext, reason, seen_at "
+    "FROM junk_candidates "
+    "WHERE (:q IS NULL OR instr(lower(path), :q) > 0) "
+    "ORDER BY path LIMIT :lim")
+DELETE_JUNK_SQL = ("DELETE FROM junk_candidates "
+                   "WHERE path_hash=? AND path=?")
+CLEAR_JUNK_RANGE_SQL = (
+    "DELETE FROM junk_candidates WHERE path >= ? AND path < ?")
+CLEAR_FILES_RANGE_SQL = "DELETE FROM files WHERE path >= ? AND path < ?"
+COUNT_FILES_RANGE_SQL = (
+    "SELECT COUNT(*) FROM files WHERE path >= ? AND path < ?")
+COUNT_FILES_ROOT_SQL = "SELECT COUNT(*) FROM files WHERE root_id=?"
+GET_ROOT_ID_SQL = "SELECT id FROM roots WHERE path=?"
+DELETE_FILE_SQL = "DELETE FROM files WHERE path_hash=? AND path=?"
+LOG_OPERATION_SQL = (
+    "INSERT INTO operations_log(op, src, dst, detail, at) "
+    "VALUES(?,?,?,?,?)")
+ADD_ROOT_SQL = (
+    "INSERT INTO roots(path, enabled, added_at) VALUES(?,1,?) "
+    "ON CONFLICT(path) DO NOTHING")
+ENABLED_ROOTS_SQL = "SELECT path FROM roots WHERE enabled=1 ORDER BY path"
+UNKNOWN_EXTS_SQL = (
+    "SELECT ext, cnt, sample_path FROM ext_counts "
+    "WHERE kind = 'unknown' AND cnt > 0 "
+    "ORDER BY cnt DESC LIMIT ?")
+
+
+def normalize_path(p) -> str:
+    """Canonical stored form of a path: POSIX separators, NFC.
+
+    Normalizing once at write time means lookups and prefix ranges
+    compare plain BINARY strings — no per-query rstrip/encoding fixups
+    at every call site.
+    """
+    return unicodedata.normalize("NFC", str(p).replace(os.sep, "/"))
+
+
+def path_hash(p: str) -> int:
+    """Stable 64-bit hash of a path, stored alongside it for lookups.
+
+    Equality probes compare 8-byte integers through idx_files_hash
+    instead of walking the UNIQUE(path) B-tree comparing 100+ byte
+    strings; the trailing path=? check resolves the rare collision.
+    xxhash when available, a truncated blake2b otherwise — both stable
+    across processes, unlike Python's salted hash().
+    """
+    if xxhash is not None:
+        h = xxhash.xxh64_intdigest(p)
+    else:
+        h = int.from_bytes(
+            hashlib.blake2b(p.encode(), digest_size=8).digest(), "little")
+    # SQLite INTEGER is signed 64-bit.
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+_ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+
+def compress_streams(text: Optional[str]) -> Optional[bytes]:
+    """Compress a raw ffprobe stream dump for storage.
+
+    Multi-KB JSON text dominates media_metadata row size and therefore
+    the pages the library JOINs drag through cache; zstd level 3 cuts
+    it several-fold. Without zstandard the plain bytes are stored —
+    decompress_streams sniffs the frame magic either way.
+
+    The dump is stored verbatim: it comes straight from ffprobe's own
+    -print_format json output, so re-validating it with SQLite's
+    json() on every insert would only re-parse trusted text.
+    """
+    if text is None:
+        return None
+    raw = text.encode()
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(raw)
+    return raw
+
+
+def decompress_streams(blob: Optional[bytes]) -> Optional[str]:
+    if blob is None:
+        return None
+    blob = bytes(blob)
+    if blob[:4] == _ZSTD_MAGIC and zstandard is not None:
+        blob = zstandard.ZstdDecompressor().decompress(blob)
+    return blob.decode()
+
+
+def get_streams_json(conn: sqlite3.Connection,
+                     file_id: int) -> Optional[str]:
+    row = conn.execute(GET_STREAMS_SQL, (file_id,)).fetchone()
+    return decompress_streams(row[0]) if row else None
+
+
+def connect(db_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(db_path), isolation_level=None,
+                           check_same_thread=False, cached_statements=512)
+    conn.create_function("pathhash", 1, path_hash, deterministic=True)
+    conn.executescript(SCHEMA)
+    _migrate_indexes(conn)
+    _migrate_path_hash(conn)
+    _migrate_streams_blob(conn)
+    _migrate_group_key(conn)
+    _migrate_ext_counts(conn)
+    _migrate_root_id(conn)
+    _migrate_junk_rowid(conn)
+    _migrate_display_cols(conn)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA foreign_keys=ON")
+    # Under WAL, synchronous=NORMAL only fsyncs on checkpoint, so a
+    # scan's stream of upserts is WAL-append-bound rather than
+    # commit-latency-bound. MEDIA_DB_DURABLE=1 restores FULL for anyone
+    # who wants every commit on stable storage.
+    if os.environ.get("MEDIA_DB_DURABLE"):
+        conn.execute("PRAGMA synchronous=FULL")
+    else:
+        conn.execute("PRAGMA synchronous=NORMAL")
+    # 64 MiB page cache + mmap keep the JOIN-heavy library/duplicates
+    # queries from re-reading the same B-tree pages off disk.
+    conn.execute("PRAGMA cache_size=-65536")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA mmap_size=1073741824")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA wal_autocheckpoint=2000")
+    # BINARY collation + case-sensitive LIKE lets any remaining LIKE
+    # 'prefix%' query use the UNIQUE(path) index instead of scanning.
+    conn.execute("PRAGMA case_sensitive_like=ON")
+    # Keep planner stats in step with whatever indexes the schema step
+    # just created; without them it tends to ignore the hash indexes.
+    # analysis_limit bounds every ANALYZE (including maintenance) to a
+    # sample, so it stays in the milliseconds on large tables.
+    conn.execute("PRAGMA analysis_limit=1000")
+    conn.execute("ANALYZE")
+    return conn
+
+
+def _migrate_indexes(conn: sqlite3.Connection) -> None:
+    """Rebuild indexes that predate their partial form.
+
+    Full-hash and roots-enabled indexes used to cover every row; the
+    partial versions skip the NULL/disabled majority, which shrinks
+    them and cheapens every hashes/roots write. executescript leaves an
+    existing same-named index alone, so older databases are migrated
+    here by hand.
+    """
+    partials = {
+        "idx_hashes_fullhash": (
+            "CREATE INDEX idx_hashes_fullhash ON hashes(full_hash) "
+            "WHERE full_hash IS NOT NULL"),
+        "idx_roots_enabled": (
+            "CREATE INDEX idx_roots_enabled ON roots(path) "
+            "WHERE enabled=1"),
+    }
+    for name, create_sql in partials.items():
+        row = conn.execute(
+            "SELECT sql FROM sqlite_master WHERE type='index' AND name=?",
+            (name,)).fetchone()
+        if row and row[0] and "WHERE" not in row[0]:
+            conn.execute("DROP INDEX %s" % name)
+            conn.execute(create_sql)
+
+
+def _migrate_path_hash(conn: sqlite3.Connection) -> None:
+    """Add and backfill path_hash on databases that predate it.
+
+    The indexes live here rather than in SCHEMA because on an old
+    database they could only be created once the column exists.
+    """
+    for table, index in (("files", "idx_files_hash"),
+                         ("junk_candidates", "idx_junk_hash")):
+        cols = {r[1] for r in conn.execute("PRAGMA table_info(%s)" % table)}
+        if "path_hash" not in cols:
+            conn.execute("ALTER TABLE %s ADD COLUMN path_hash INTEGER"
+                         % table)
+        conn.execute("UPDATE %s SET path_hash = pathhash(path) "
+                     "WHERE path_hash IS NULL" % table)
+        conn.execute("CREATE INDEX IF NOT EXISTS %s ON %s(path_hash)"
+                     % (index, table))
+
+
+def _migrate_group_key(conn: sqlite3.Connection) -> None:
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(hashes)")}
+    if "group_key" not in cols:
+        conn.execute("ALTER TABLE hashes ADD COLUMN group_key TEXT")
+    conn.execute(
+        "UPDATE hashes SET group_key = ("
+        "  SELECT CASE WHEN hashes.full_hash IS NOT NULL "
+        "              THEN 'F:' || hashes.full_hash "
+        "              WHEN hashes.sample_hash IS NOT NULL "
+        "              THEN 'S:' || hashes.sample_hash || ':' || f.size "
+        "         END FROM files f WHERE f.id = hashes.file_id"
+        ") WHERE group_key IS NULL")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_hashes_gkey "
+                 "ON hashes(group_key)")
+
+
+def _migrate_streams_blob(conn: sqlite3.Connection) -> None:
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(media_metadata)")}
+    if "streams_zst" not in cols:
+        conn.execute(
+            "ALTER TABLE media_metadata ADD COLUMN streams_zst BLOB")
+
+
+# Basename of a path in pure SQL — same rtrim/replace trick
+# LIST_JUNK_SQL uses on '/'; paths are stored in POSIX form.
+_BASENAME_EXPR = ("replace(%(r)s.path, rtrim(%(r)s.path, "
+                  "replace(%(r)s.path, '/', '')), '')")
+
+# Extension of a path in pure SQL: text after the basename's last dot,
+# or '' — a dot in a directory name must not leak into the extension,
+# and a leading dot alone (dotfiles) doesn't make one, matching the
+# scanner's dot > 0 rule. Pure SQL rather than a UDF so the triggers
+# below keep working for any tool that opens the database without our
+# functions registered.
+_EXT_EXPR = (
+    "CASE WHEN instr(substr({n}, 2), '.') "
+    "THEN '.' || lower(replace({n}, rtrim({n}, "
+    "replace({n}, '.', '')), '')) "
+    "ELSE '' END").format(n=_BASENAME_EXPR)
+
+
+def _migrate_junk_rowid(conn: sqlite3.Connection) -> None:
+    """Rebuild junk_candidates as WITHOUT ROWID.
+
+    As a rowid table the TEXT primary key cost a second B-tree (the
+    implicit rowid one) maintained on every upsert; clustering on path
+    halves the write work and the on-disk size. operations_log keeps
+    its rowid — INTEGER PRIMARY KEY auto-assignment only exists on
+    rowid tables.
+    """
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type='table' "
+        "AND name='junk_candidates'").fetchone()
+    if row is None or "WITHOUT ROWID" in row[0]:
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute(
+            "CREATE TABLE junk_candidates_new("
+            "path TEXT PRIMARY KEY, size INTEGER, mtime REAL, ext TEXT, "
+            "reason TEXT, seen_at REAL, path_hash INTEGER) WITHOUT ROWID")
+        conn.execute(
+            "INSERT INTO junk_candidates_new "
+            "SELECT path, size, mtime, ext, reason, seen_at, path_hash "
+            "FROM junk_candidates")
+        conn.execute("DROP TABLE junk_candidates")
+        conn.execute("ALTER TABLE junk_candidates_new "
+                     "RENAME TO junk_candidates")
+        conn.execute("CREATE INDEX idx_junk_path "
+                     "ON junk_candidates(path COLLATE NOCASE)")
+        conn.execute("CREATE INDEX idx_junk_hash "
+                     "ON junk_candidates(path_hash)")
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+
+
+# Generated display columns need SQLite >= 3.31; older builds fall
+# back to formatting in Python.
+_HAS_GENERATED = sqlite3.sqlite_version_info >= (3, 31, 0)
+
+# Human-readable size, matching the GUI's "%.1f UNIT" format. VIRTUAL,
+# so it costs nothing at write time and only computes for selected
+# rows — but the computation runs in SQLite's C printf, not per-row
+# Python.
+_SIZE_STR_EXPR = (
+    "CASE WHEN size IS NULL THEN NULL "
+    "WHEN size < 1024 THEN printf('%.1f B', size * 1.0) "
+    "WHEN size < 1048576 THEN printf('%.1f KB', size / 1024.0) "
+    "WHEN size < 1073741824 THEN printf('%.1f MB', size / 1048576.0) "
+    "WHEN size < 1099511627776 "
+    "THEN printf('%.1f GB', size / 1073741824.0) "
+    "WHEN size < 1125899906842624 "
+    "THEN printf('%.1f TB', size / 1099511627776.0) "
+    "ELSE printf('%.1f PB', size / 1125899906842624.0) END")
+# The local-time strftime is non-deterministic, which generated
+# columns reject, so the mtime string is computed in the SELECT list
+# instead — still SQLite's C strftime rather than per-row Python.
+_MTIME_STR_EXPR = (
+    "strftime('%Y-%m-%d %H:%M', f.mtime, 'unixepoch', 'localtime')")
+
+
+def _migrate_display_cols(conn: sqlite3.Connection) -> None:
+    """Add the generated size_str display column to files."""
+    if not _HAS_GENERATED:
+        return
+    # table_xinfo, not table_info: generated columns are hidden from
+    # the plain variant.
+    cols = {r[1] for r in conn.execute("PRAGMA table_xinfo(files)")}
+    if "size_str" not in cols:
+        conn.execute(
+            "ALTER TABLE files ADD COLUMN size_str TEXT "
+            "GENERATED ALWAYS AS (%s) VIRTUAL" % _SIZE_STR_EXPR)
+
+
+def _migrate_root_id(conn: sqlite3.Connection) -> None:
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(files)")}
+    if "root_id" not in cols:
+        conn.execute("ALTER TABLE files ADD COLUMN root_id INTEGER")
+        conn.execute(
+            "UPDATE files SET root_id = (SELECT id FROM roots "
+            "WHERE substr(files.path, 1, length(roots.path) + 1) "
+            "      = roots.path || '/' "
+            "ORDER BY length(roots.path) DESC LIMIT 1)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_files_root "
+                 "ON files(root_id)")
+
+
+def _migrate_ext_counts(conn: sqlite3.Connection) -> None:
+    """Summary table of file counts per (kind, extension).
+
+    Trigger-maintained so list_unknown_extensions reads O(distinct
+    exts) rows instead of re-aggregating every unknown file on each
+    GUI refresh. Backfilled from files when first created.
+    """
+    fresh = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' "
+        "AND name='ext_counts'").fetchone() is None
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS ext_counts("
+        "kind TEXT, ext TEXT, cnt INTEGER, sample_path TEXT, "
+        "PRIMARY KEY(kind, ext)) WITHOUT ROWID")
+    new_ext = _EXT_EXPR % {"r": "NEW"}
+    old_ext = _EXT_EXPR % {"r": "OLD"}
+    # Databases written before the extension expression learned to
+    # strip the directory part carry triggers (and counts) computed
+    # with the old formula; rebuild both when the stored trigger SQL
+    # doesn't match the current expression.
+    row = conn.execute(
+        "SELECT sql FROM sqlite_master WHERE type='trigger' "
+        "AND name='trg_files_ext_ins'").fetchone()
+    if row is not None and new_ext not in row[0]:
+        for trg in ("trg_files_ext_ins", "trg_files_ext_del",
+                    "trg_files_ext_upd"):
+            conn.execute("DROP TRIGGER IF EXISTS %s" % trg)
+        conn.execute("DELETE FROM ext_counts")
+        fresh = True
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_files_ext_ins "
+        "AFTER INSERT ON files BEGIN "
+        "INSERT INTO ext_counts(kind, ext, cnt, sample_path) "
+        "VALUES(COALESCE(NEW.kind, ''), " + new_ext + ", 1, NEW.path) "
+        "ON CONFLICT(kind, ext) DO UPDATE SET cnt = cnt + 1; END")
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_files_ext_del "
+        "AFTER DELETE ON files BEGIN "
+        "UPDATE ext_counts SET cnt = cnt - 1 "
+        "WHERE kind = COALESCE(OLD.kind, '') AND ext = " + old_ext
+        + "; END")
+    conn.execute(
+        "CREATE TRIGGER IF NOT EXISTS trg_files_ext_upd "
+        "AFTER UPDATE OF kind ON files "
+        "WHEN NEW.kind IS NOT OLD.kind BEGIN "
+        "UPDATE ext_counts SET cnt = cnt - 1 "
+        "WHERE kind = COALESCE(OLD.kind, '') AND ext = " + old_ext + "; "
+        "INSERT INTO ext_counts(kind, ext, cnt, sample_path) "
+        "VALUES(COALESCE(NEW.kind, ''), " + new_ext + ", 1, NEW.path) "
+        "ON CONFLICT(kind, ext) DO UPDATE SET cnt = cnt + 1; END")
+    if fresh:
+        conn.execute(
+            "INSERT INTO ext_counts(kind, ext, cnt, sample_path) "
+            "SELECT COALESCE(kind, ''), "
+            + (_EXT_EXPR % {"r": "files"})
+            + ", COUNT(*), MIN(path) FROM files GROUP BY 1, 2")
+
+
+def maintenance(conn: sqlite3.Connection) -> None:
+    """Refresh planner statistics; run after bulk ingest or on idle.
+
+    Without fresh stats the planner can keep a stale JOIN plan for
+    fetch_duplicate_rows long after millions of rows have landed.
+    Bounded by the connection's analysis_limit, so it is cheap enough
+    to call from a GUI idle timer.
+    """
+    try:
+        with _write_lock_for(conn):
+            conn.execute("ANALYZE")
+            conn.execute("PRAGMA optimize")
+    except sqlite3.Error as exc:
+        print("db maintenance failed: %s" % exc, file=sys.stderr)
+
+
+def close(conn: sqlite3.Connection) -> None:
+    """Close a connection, letting SQLite fold query stats back in."""
+    flush_log()
+    try:
+        conn.execute("PRAGMA optimize")
+    except sqlite3.Error:
+        pass
+    conn.close()
+
+
+def connect_reader(db_path: Path) -> sqlite3.Connection:
+    """Open one read-only connection for queries off the GUI thread.
+
+    Under WAL, readers on their own connection run concurrently with
+    the writer; sharing the writer connection serializes every GUI
+    query behind in-flight scan transactions.
+    """
+    conn = sqlite3.connect("file:%s?mode=ro" % db_path, uri=True,
+                           check_same_thread=False, cached_statements=512)
+    conn.execute("PRAGMA query_only=ON")
+    conn.execute("PRAGMA busy_timeout=5000")
+    conn.execute("PRAGMA cache_size=-16384")
+    return conn
+
+
+class ConnPool:
+    """One writer connection plus a small pool of read-only ones.
+
+    All mutations go through writer(); reads borrow a pooled reader via
+    the reader() context manager, so a junk-tab reload never waits on a
+    background scan's transaction.
+    """
+
+    def __init__(self, db_path: Path, readers: int = 4):
+        self.db_path = db_path
+        self._writer = connect(db_path)
+        self._readers: queue.Queue = queue.Queue()
+        for _ in range(readers):
+            self._readers.put(connect_reader(db_path))
+
+    def writer(self) -> sqlite3.Connection:
+        return self._writer
+
+    @contextlib.contextmanager
+    def reader(self):
+        conn = self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    def close(self) -> None:
+        close(self._writer)
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+# One write lock per writer connection. sqlite3.Connection objects
+# can't carry attributes, so the locks live here, keyed by identity;
+# pool writers are process-lived, so the registry never churns. Locks
+# are per-connection because that is the hazard being excluded:
+# SQLite serializes *across* connections itself, but two threads
+# sharing one connection can nest BEGINs or roll back each other's
+# half-applied transactions.
+_write_locks: dict[int, threading.RLock] = {}
+_write_locks_guard = threading.Lock()
+
+
+def _write_lock_for(conn: sqlite3.Connection) -> threading.RLock:
+    lock = _write_locks.get(id(conn))
+    if lock is None:
+        with _write_locks_guard:
+            lock = _write_locks.setdefault(id(conn), threading.RLock())
+    return lock
+
+
+@contextlib.contextmanager
+def write_transaction(conn: sqlite3.Connection):
+    """One mutually-exclusive BEGIN IMMEDIATE..COMMIT on this connection.
+
+    Every write transaction on a shared writer connection must come
+    through here (the bulk helpers already do): the per-connection
+    lock keeps the GUI, scan workers and ingest handlers from
+    interleaving statements or destroying each other's transactions
+    with a ROLLBACK. Reentrant — a helper called inside an enclosing
+    write_transaction joins it instead of nesting a second BEGIN.
+    """
+    lock = _write_lock_for(conn)
+    with lock:
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+
+def _prefix_range(prefix: str) -> tuple[str, str]:
+    """Bounds for a half-open [lo, hi) range covering prefix matches.
+
+    `WHERE path >= lo AND path < hi` walks the UNIQUE(path) B-tree
+    directly; `LIKE 'prefix%'` only uses the index under conditions the
+    default collation doesn't meet, and degrades to a full scan. The
+    upper bound increments the prefix's last code point.
+    """
+    prefix = normalize_path(prefix)
+    if not prefix.endswith("/"):
+        prefix += "/"
+    i = len(prefix) - 1
+    while i >= 0 and ord(prefix[i]) >= 0x10FFFF:
+        i -= 1
+    if i < 0:
+        return prefix, "\U0010ffff"
+    return prefix, prefix[:i] + chr(ord(prefix[i]) + 1)
+
+
+BATCH_SIZE = 5000
+
+
+def _run_batched(conn: sqlite3.Connection, sql: str,
+                 rows: list[tuple]) -> None:
+    """executemany in explicit transactions of BATCH_SIZE rows.
+
+    The connection runs in autocommit, so without the explicit BEGIN
+    each row would pay its own WAL commit; batching turns a scan's
+    worth of upserts into a handful of commits. Inside an enclosing
+    write_transaction the chunks join it instead.
+    """
+    for i in range(0, len(rows), BATCH_SIZE):
+        with write_transaction(conn):
+            conn.executemany(sql, rows[i:i + BATCH_SIZE])
+
+
+def upsert_files_many(conn: sqlite3.Connection, rows: list[tuple]) -> None:
+    """Bulk upsert of (path, kind, size, mtime, first_seen, last_seen)."""
+    _run_batched(conn, UPSERT_FILES_SQL,
+                 [(normalize_path(r[0]),) + tuple(r[1:]) for r in rows])
+
+
+# RETURNING needs SQLite >= 3.35; older builds keep the follow-up
+# SELECT id lookup.
+_HAS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def upsert_file(conn: sqlite3.Connection, path: str, kind: str, size: int,
+                mtime: float, ts: Optional[float] = None) -> int:
+    ts = ts if ts is not None else time.time()
+    row = (normalize_path(path), kind, size, mtime, ts, ts)
+    path = row[0]
+    if _HAS_RETURNING:
+        with _write_lock_for(conn):
+            cur = conn.execute(UPSERT_FILE_RETURNING_SQL, row)
+            return int(cur.fetchone()[0])
+    upsert_files_many(conn, [row])
+    cur = conn.execute(GET_FILE_ID_SQL, (path_hash(path), path))
+    return cur.fetchone()[0]
+
+
+def upsert_files_many_ids(conn: sqlite3.Connection,
+                          rows: list[tuple]) -> dict[str, int]:
+    """Bulk file upsert that also maps each path back to its row id.
+
+    executemany cannot carry RETURNING, so this runs one statement per
+    row — still inside BATCH_SIZE-sized transactions — and correlates
+    via RETURNING id, path, avoiding a second per-path lookup. Use
+    upsert_files_many when the ids aren't needed. The returned map is
+    keyed by the stored (normalized) path form.
+    """
+    rows = [(normalize_path(r[0]),) + tuple(r[1:]) for r in rows]
+    ids: dict[str, int] = {}
+    if not _HAS_RETURNING:
+        upsert_files_many(conn, rows)
+        for row in rows:
+            ids[row[0]] = conn.execute(
+                GET_FILE_ID_SQL, (path_hash(row[0]), row[0])).fetchone()[0]
+        return ids
+    for i in range(0, len(rows), BATCH_SIZE):
+        with write_transaction(conn):
+            for row in rows[i:i + BATCH_SIZE]:
+                rid, path = conn.execute(UPSERT_FILE_RETURNING_PATH_SQL,
+                                         row).fetchone()
+                ids[path] = int(rid)
+    return ids
+
+
+def get_file_row(conn: sqlite3.Connection, path: str) -> Optional[tuple]:
+    path = normalize_path(path)
+    cur = conn.execute(GET_FILE_SQL, (path_hash(path), path))
+    return cur.fetchone()
+
+
+def upsert_hashes_many(conn: sqlite3.Connection, rows: list[tuple]) -> None:
+    """Bulk upsert of (file_id, algo, sample_size, sample_hash,
+    full_hash, hashed_at)."""
+    _run_batched(conn, UPSERT_HASHES_SQL, rows)
+
+
+def upsert_hash(conn: sqlite3.Connection, file_id: int, algo: str,
+                sample_size: int, sample_hash: Optional[str],
+                full_hash: Optional[str],
+                ts: Optional[float] = None) -> None:
+    upsert_hashes_many(conn, [(file_id, algo, sample_size, sample_hash,
+                               full_hash,
+                               ts if ts is not None else time.time())])
+
+
+def get_hash_row(conn: sqlite3.Connection, file_id: int) -> Optional[tuple]:
+    cur = conn.execute(GET_HASH_SQL, (file_id,))
+    return cur.fetchone()
+
+
+def upsert_metadata_many(conn: sqlite3.Connection,
+                         rows: list[tuple]) -> None:
+    """Bulk upsert of (file_id, duration, width, height, video_codec,
+    audio_codec, container, probed_at, streams_zst).
+
+    streams_zst is the compress_streams() form of the raw dump; the
+    grouping and library queries never select it, so its size only
+    matters when get_streams_json is actually called."""
+    _run_batched(conn, UPSERT_METADATA_SQL, rows)
+
+
+def upsert_metadata(conn: sqlite3.Connection, file_id: int,
+                    duration: Optional[float], width: Optional[int],
+                    height: Optional[int], video_codec: Optional[str],
+                    audio_codec: Optional[str], container: Optional[str],
+                    ts: Optional[float] = None,
+                    streams_json: Optional[str] = None) -> None:
+    upsert_metadata_many(conn, [(file_id, duration, width, height,
+                                 video_codec, audio_codec, container,
+                                 ts if ts is not None else time.time(),
+                                 compress_streams(streams_json))])
+
+
+def upsert_junk(conn: sqlite3.Connection, path: str, size: int, mtime: float,
+                ext: str, reason: str, ts: Optional[float] = None) -> None:
+    # Canonicalized on the way in like every other write path:
+    # LIST_JUNK_SQL's basename split and the clear_* range bounds both
+    # assume stored POSIX/NFC form, so a raw NFD or backslash path
+    # would make an undeletable row.
+    path = normalize_path(path)
+    with _write_lock_for(conn):
+        conn.execute(
+            UPSERT_JUNK_SQL,
+            (path, size, mtime, ext, reason,
+             ts if ts is not None else time.time()))
+
+
+def fetch_library_rows(conn: sqlite3.Connection,
+                       kind: Optional[str] = None,
+                       search: Optional[str] = None,
+                       after_path: Optional[str] = None,
+                       limit: int = 5000) -> Iterator[tuple]:
+    """Rows for the library table: file fields + hash + probed metadata.
+
+    Pages by keyset: pass the last path of the previous page as
+    after_path and the query seeks straight to it in the UNIQUE(path)
+    index (already path-ordered, so no sort step either), instead of
+    OFFSET re-scanning and discarding everything before it. Yields rows
+    as pysqlite steps the cursor, so no page is materialized twice.
+
+    kind and search filter inside SQLite (search is a case-insensitive
+    substring match on the path, as in list_junk), so non-matching rows
+    never cross the C-to-Python boundary.
+
+    The trailing size_str/mtime_str columns are display strings built
+    in SQL — size_str from the generated column (NULL on SQLite builds
+    without generated-column support, callers fall back to Python
+    formatting), mtime_str via strftime in the SELECT list. probed_at
+    rides along as the metadata freshness marker the GUI's row cache
+    keys on.
+    """
+    display = (("f.size_str, " + _MTIME_STR_EXPR) if _HAS_GENERATED
+               else "NULL, " + _MTIME_STR_EXPR)
+    sql = (
+        "SELECT f.path, f.kind, f.size, f.mtime, h.full_hash, "
+        "m.duration, m.width, m.height, m.video_codec, m.container, "
+        "m.probed_at, " + display + " FROM files f "
+        "LEFT JOIN hashes h ON h.file_id = f.id "
+        "LEFT JOIN media_metadata m ON m.file_id = f.id "
+        "WHERE (:after IS NULL OR f.path > :after) ")
+    if kind is not None:
+        sql += "AND f.kind = :kind "
+    if search:
+        sql += "AND instr(lower(f.path), :search) > 0 "
+    sql += "ORDER BY f.path LIMIT :lim"
+    yield from conn.execute(
+        sql, {"after": after_path, "kind": kind,
+              "search": (search or "").strip().lower(), "lim": limit})
+
+
+def fetch_library_paths(conn: sqlite3.Connection,
+                        root: Optional[str] = None) -> Iterator[str]:
+    """Stream the paths of library files, optionally under one root.
+
+    Paths are stored normalized, so the root filter is the same BINARY
+    half-open prefix range the rest of the module uses: a seek in the
+    UNIQUE(path) index rather than a LIKE scan, and only matching
+    paths cross into Python. Yields as pysqlite steps the cursor —
+    path-ordered by the index, never materialized here.
+    """
+    if root:
+        lo, hi = _prefix_range(normalize_path(root).rstrip("/"))
+        cur = conn.execute(
+            "SELECT path FROM files WHERE path >= ? AND path < ? "
+            "ORDER BY path", (lo, hi))
+    else:
+        cur = conn.execute("SELECT path FROM files ORDER BY path")
+    for (path,) in cur:
+        yield path
+
+
+def library_fingerprint(conn: sqlite3.Connection,
+                        kind: Optional[str] = None,
+                        search: Optional[str] = None) -> tuple:
+    """(row count, max mtime, total size) for the filtered library set.
+
+    A cheap stand-in for "did anything change": refresh paths compare
+    it against the last one and skip rebuilding their models when it
+    matches. Uses the same filters as fetch_library_rows so the two
+    always describe the same row set. The hash and metadata counts are
+    included because both arrive after the file rows do, changing the
+    display without touching count, mtime or size.
+    """
+    sql = ("SELECT COUNT(*), MAX(f.mtime), COALESCE(SUM(f.size), 0), "
+           "COUNT(h.full_hash), COUNT(m.file_id) "
+           "FROM files f "
+           "LEFT JOIN hashes h ON h.file_id = f.id "
+           "LEFT JOIN media_metadata m ON m.file_id = f.id "
+           "WHERE 1=1 ")
+    if kind is not None:
+        sql += "AND f.kind = :kind "
+    if search:
+        sql += "AND instr(lower(f.path), :search) > 0 "
+    return conn.execute(
+        sql, {"kind": kind,
+              "search": (search or "").strip().lower()}).fetchone()
+
+
+def duplicate_metadata_fingerprint(conn: sqlite3.Connection,
+                                   include_suspected: bool = True
+                                   ) -> tuple:
+    """(metadata row count, newest probed_at) over hash-grouped files.
+
+    Complements fetch_duplicate_groups as a change signal: probe
+    metadata lands after hashing and changes the duplicates tab's
+    Duration cells without touching membership, sizes or waste, so the
+    refresh folds this pair into its skip signature. Aggregated over
+    all grouped hashes rather than only multi-member groups — the
+    occasional extra refetch is cheaper than re-running the membership
+    window on every poll.
+    """
+    sql = (
+        "SELECT COUNT(*), COALESCE(MAX(m.probed_at), 0) "
+        "FROM hashes h JOIN media_metadata m ON m.file_id = h.file_id "
+        "WHERE h.group_key IS NOT NULL%s"
+        % ("" if include_suspected else " AND h.full_hash IS NOT NULL"))
+    return conn.execute(sql).fetchone()
+
+
+def fetch_duplicate_rows(conn: sqlite3.Connection,
+                         include_suspected: bool = True) -> list[tuple]:
+    """Duplicate groups: confirmed by full hash, suspected by sample+size.
+
+    Returns (group_key, path, size, mtime, duration, confirmed,
+    size_str, mtime_str) rows ordered so same-group rows are adjacent;
+    the trailing display strings are built in SQL, with size_str NULL
+    on builds without generated-column support.
+    """
+    display = (("f.size_str, " if _HAS_GENERATED else
+                "NULL AS size_str, ")
+               + _MTIME_STR_EXPR + " AS mtime_str")
+    # group_key is materialized and indexed, so membership counting is
+    # an index scan with no per-row string concatenation.
+    sql = (
+        "SELECT gkey, path, size, mtime, duration, confirmed, "
+        "size_str, mtime_str FROM ("
+        "  SELECT h.group_key AS gkey, "
+        "         (h.full_hash IS NOT NULL) AS confirmed, "
+        "         f.path, f.size, f.mtime, m.duration, "
+        + display + ", "
+        "         COUNT(*) OVER (PARTITION BY h.group_key) AS members "
+        "  FROM hashes h "
+        "  JOIN files f ON f.id = h.file_id "
+        "  LEFT JOIN media_metadata m ON m.file_id = f.id "
+        "  WHERE h.group_key IS NOT NULL%s"
+        ") WHERE members > 1 "
+        "ORDER BY confirmed DESC, gkey, path"
+        % ("" if include_suspected else " AND h.full_hash IS NOT NULL"))
+    return conn.execute(sql).fetchall()
+
+
+def fetch_duplicate_groups(conn: sqlite3.Connection,
+                           include_suspected: bool = True) -> list[tuple]:
+    """Aggregate duplicate stats: (group_key, member_count, size,
+    total_wasted) per group with more than one member.
+
+    The GROUP BY runs over the indexed group_key, so summarizing a
+    large library never pulls the member rows into Python; wasted
+    bytes count every copy past the first.
+    """
+    sql = (
+        "SELECT h.group_key, COUNT(*) AS n, MAX(f.size), "
+        "       (COUNT(*) - 1) * MAX(f.size) AS wasted "
+        "FROM hashes h JOIN files f ON f.id = h.file_id "
+        "WHERE h.group_key IS NOT NULL%s "
+        "GROUP BY h.group_key HAVING n > 1"
+        % ("" if include_suspected else " AND h.full_hash IS NOT NULL"))
+    return conn.execute(sql).fetchall()
+
+
+def list_junk(conn: sqlite3.Connection, query: Optional[str] = None,
+              limit: int = 5000) -> list[tuple]:
+    """(name, path, size, mtime, ext, reason, seen_at) junk rows.
+
+    Filtered inside SQLite rather than in Python: pushing the
+    substring match into the query keeps unmatched rows from ever
+    crossing the C-to-Python boundary on each keystroke.
+    """
+    q = query.strip().lower() if query else None
+    cur = conn.execute(LIST_JUNK_SQL, {"q": q or None, "lim": limit})
+    return cur.fetchall()
+
+
+def delete_junk_entry(conn: sqlite3.Connection, path: str) -> None:
+    with _write_lock_for(conn):
+        conn.execute(DELETE_JUNK_SQL, (path_hash(path), path))
+
+
+def clear_junk_under_root(conn: sqlite3.Connection, root: str) -> int:
+    lo, hi = _prefix_range(root)
+    with _write_lock_for(conn):
+        cur = conn.execute(CLEAR_JUNK_RANGE_SQL, (lo, hi))
+    return cur.rowcount
+
+
+def clear_root(conn: sqlite3.Connection, root: str) -> int:
+    """Drop everything indexed under one root.
+
+    Stages victim file ids in a temp table and deletes the child rows
+    explicitly, so SQLite does three bulk B-tree deletes instead of
+    resolving the ON DELETE CASCADE walk once per files row.
+    """
+    lo, hi = _prefix_range(root)
+    with write_transaction(conn):
+        conn.execute("CREATE TEMP TABLE victims(id INTEGER PRIMARY KEY)")
+        conn.execute(
+            "INSERT INTO victims(id) "
+            "SELECT id FROM files WHERE path >= ? AND path < ?", (lo, hi))
+        conn.execute("DELETE FROM hashes WHERE file_id IN "
+                     "(SELECT id FROM victims)")
+        conn.execute("DELETE FROM media_metadata WHERE file_id IN "
+                     "(SELECT id FROM victims)")
+        cur = conn.execute(CLEAR_FILES_RANGE_SQL, (lo, hi))
+        conn.execute(CLEAR_JUNK_RANGE_SQL, (lo, hi))
+        conn.execute("DROP TABLE victims")
+    return cur.rowcount
+
+
+def count_files_under_root(conn: sqlite3.Connection, root: str) -> int:
+    root = normalize_path(root)
+    row = conn.execute(GET_ROOT_ID_SQL, (root.rstrip("/"),)).fetchone()
+    if row is not None:
+        cur = conn.execute(COUNT_FILES_ROOT_SQL, (row[0],))
+    else:
+        # Arbitrary sub-directories aren't registered roots; fall back
+        # to the indexed path range.
+        lo, hi = _prefix_range(root)
+        cur = conn.execute(COUNT_FILES_RANGE_SQL, (lo, hi))
+    return cur.fetchone()[0]
+
+
+def clear_all_library(conn: sqlite3.Connection) -> None:
+    """Empty every library table with ordered whole-table deletes.
+
+    Foreign keys are switched off around the transaction (the pragma is
+    a no-op inside one) so the unqualified DELETEs hit the truncate
+    optimization instead of the per-row cascade.
+    """
+    with _write_lock_for(conn):
+        conn.execute("PRAGMA foreign_keys=OFF")
+        try:
+            with write_transaction(conn):
+                conn.execute("DELETE FROM hashes")
+                conn.execute("DELETE FROM media_metadata")
+                conn.execute("DELETE FROM files")
+                conn.execute("DELETE FROM junk_candidates")
+        finally:
+            conn.execute("PRAGMA foreign_keys=ON")
+
+
+def delete_file_entry(conn: sqlite3.Connection, path: str) -> None:
+    path = normalize_path(path)
+    with _write_lock_for(conn):
+        conn.execute(DELETE_FILE_SQL, (path_hash(path), path))
+
+
+def delete_file_entries(conn: sqlite3.Connection, paths) -> None:
+    """Delete many file rows with one executemany statement.
+
+    The statement is prepared once and stepped per row inside the
+    caller's transaction, instead of a parse + commit per path.
+    """
+    rows = []
+    for p in paths:
+        p = normalize_path(p)
+        rows.append((path_hash(p), p))
+    with _write_lock_for(conn):
+        conn.executemany(DELETE_FILE_SQL, rows)
+
+
+def list_unknown_extensions(conn: sqlite3.Connection,
+                            limit: int = 200) -> list[tuple]:
+    """(ext, count, sample path) for unknown files, from ext_counts."""
+    cur = conn.execute(UNKNOWN_EXTS_SQL, (limit,))
+    return cur.fetchall()
+
+
+class _LogWriter(threading.Thread):
+    """Daemon thread committing operations_log rows in batches.
+
+    GUI bulk actions (trash/delete loops) enqueue a row per file;
+    without this each one would pay its own WAL commit. Entries are
+    drained every half second or 500 rows, grouped per database, and
+    committed on the writer's own connection for that database —
+    operations_log has no foreign-key dependents, so the drain
+    serializes against other writers through SQLite's WAL locking
+    instead of running transactions on a connection some other thread
+    may be mid-transaction on.
+    """
+
+    BATCH_LIMIT = 500
+
+    def __init__(self):
+        super().__init__(name="db-oplog-writer", daemon=True)
+        self._q: queue.Queue = queue.Queue()
+        # id(conn) -> database file; resolved once per caller conn.
+        self._paths: dict[int, str] = {}
+        # database file -> this thread's own connection.
+        self._conns: dict[str, sqlite3.Connection] = {}
+
+    def put(self, conn: sqlite3.Connection, row: tuple) -> None:
+        key = id(conn)
+        path = self._paths.get(key)
+        if path is None:
+            path = conn.execute("PRAGMA database_list").fetchone()[2]
+            self._paths[key] = path
+        # In-memory/temporary databases can't be reopened by path;
+        # their rows fall back to the caller's connection, serialized
+        # by its write lock.
+        self._q.put((path or conn, row))
+
+    def flush(self) -> None:
+        self._q.join()
+
+    def _conn_for(self, path: str) -> sqlite3.Connection:
+        conn = self._conns.get(path)
+        if conn is None:
+            conn = sqlite3.connect(path)
+            conn.isolation_level = None
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._conns[path] = conn
+        return conn
+
+    def run(self) -> None:
+        while True:
+            try:
+                entry = self._q.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            entries = [entry]
+            while len(entries) < self.BATCH_LIMIT:
+                try:
+                    entries.append(self._q.get_nowait())
+                except queue.Empty:
+                    break
+            by_target: dict = {}
+            for target, row in entries:
+                by_target.setdefault(target, []).append(row)
+            for target, rows in by_target.items():
+                conn = (self._conn_for(target)
+                        if isinstance(target, str) else target)
+                try:
+                    with write_transaction(conn):
+                        conn.executemany(LOG_OPERATION_SQL, rows)
+                except sqlite3.Error as exc:
+                    print("operations log write failed: %s" % exc,
+                          file=sys.stderr)
+            for _ in entries:
+                self._q.task_done()
+
+
+_log_writer: Optional[_LogWriter] = None
+_log_writer_lock = threading.Lock()
+
+
+def _get_log_writer() -> _LogWriter:
+    global _log_writer
+    if _log_writer is None:
+        with _log_writer_lock:
+            if _log_writer is None:
+                writer = _LogWriter()
+                writer.start()
+                _log_writer = writer
+    return _log_writer
+
+
+def flush_log() -> None:
+    """Block until every queued operations_log row is committed."""
+    if _log_writer is not None:
+        _log_writer.flush()
+
+
+def log_operation(conn: sqlite3.Connection, op: str, src: str,
+                  dst: Optional[str] = None,
+                  detail: Optional[str] = None) -> None:
+    _get_log_writer().put(conn, (op, src, dst, detail, time.time()))
+
+
+def log_operations(conn: sqlite3.Connection, rows) -> None:
+    """Insert many (op, src, dst, detail) log rows in one statement.
+
+    Unlike log_operation this writes inline, for callers that already
+    hold a write transaction and want the rows to share its commit
+    rather than trickle through the async writer one at a time.
+    """
+    now = time.time()
+    with _write_lock_for(conn):
+        conn.executemany(LOG_OPERATION_SQL,
+                         [(op, src, dst, detail, now)
+                          for (op, src, dst, detail) in rows])
+
+
+def add_root(conn: sqlite3.Connection, path: str) -> None:
+    with _write_lock_for(conn):
+        conn.execute(ADD_ROOT_SQL,
+                     (normalize_path(path).rstrip("/"), time.time()))
+
+
+def enabled_roots(conn: sqlite3.Connection) -> list[str]:
+    cur = conn.execute(ENABLED_ROOTS_SQL)
+    return [r[0] for r in cur.fetchall()]
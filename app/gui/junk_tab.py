@@ -0,0 +1,226 @@
+"""Junk tab: review and purge the junk candidates flagged by scans."""
+
+from __future__ import annotations
+
+import os
+import time
+from functools import lru_cache
+
+from PySide6 import QtCore, QtWidgets
+
+from app import db as dbm
+
+try:
+    from send2trash import send2trash
+except ImportError:
+    send2trash = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+COLUMNS = ("Name", "Path", "Size", "Modified", "Ext", "Reason")
+
+
+@lru_cache(maxsize=4096)
+def _human_size(n: int) -> str:
+    n = n or 0
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if n < 1024:
+            return "%.1f %s" % (n, unit)
+        n /= 1024
+    return "%.1f PB" % n
+
+
+@lru_cache(maxsize=4096)
+def _fmt_mtime(mtime: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(mtime or 0))
+
+
+class JunkModel(QtCore.QAbstractTableModel):
+    """Table model over the raw list_junk() row tuples.
+
+    Cells are formatted lazily in data(), so a reload is one list swap
+    and a model reset rather than rows x columns widget-item churn.
+    """
+
+    # Above this row count the size/mtime columns are formatted in one
+    # vectorized pass at set_rows time instead of per cell.
+    VECTOR_THRESHOLD = 1000
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows: list[tuple] = []
+        self._size_strs = None
+        self._mtime_strs = None
+
+    def set_rows(self, rows: list[tuple]) -> None:
+        self.beginResetModel()
+        self._rows = rows
+        self._size_strs = self._mtime_strs = None
+        if np is not None and len(rows) > self.VECTOR_THRESHOLD:
+            self._format_bulk(rows)
+        self.endResetModel()
+
+    def _format_bulk(self, rows: list[tuple]) -> None:
+        sizes = np.array([r[2] or 0 for r in rows], dtype=np.int64)
+        idx = np.minimum(
+            np.log2(np.maximum(sizes, 1)).astype(np.int64) // 10, 5)
+        scaled = sizes / (1024.0 ** idx)
+        units = np.array([" B", " KB", " MB", " GB", " TB", " PB"])
+        self._size_strs = np.char.add(np.char.mod("%.1f", scaled),
+                                      units[idx])
+        mtimes = np.array([r[3] or 0 for r in rows], dtype=np.int64)
+        # One current UTC offset for the whole column; rows on the
+        # other side of a DST switch render an hour off, which is fine
+        # for a display column.
+        offset = time.localtime().tm_gmtoff
+        stamps = (mtimes + offset).astype("datetime64[s]")
+        self._mtime_strs = np.char.replace(
+            np.datetime_as_string(stamps.astype("datetime64[m]")),
+            "T", " ")
+
+    def row_path(self, row: int) -> str:
+        return self._rows[row][1]
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return len(COLUMNS)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        row = self._rows[index.row()]
+        col = index.column()
+        if col == 0:
+            # Basename comes pre-extracted from list_junk's SQL.
+            return row[0]
+        if col == 1:
+            return row[1]
+        if col == 2:
+            if self._size_strs is not None:
+                return str(self._size_strs[index.row()])
+            return _human_size(row[2])
+        if col == 3:
+            if self._mtime_strs is not None:
+                return str(self._mtime_strs[index.row()])
+            return _fmt_mtime(row[3])
+        if col == 4:
+            return row[4]
+        if col == 5:
+            return row[5]
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if (orientation == QtCore.Qt.Horizontal
+                and role == QtCore.Qt.DisplayRole):
+            return COLUMNS[section]
+        return None
+
+
+class _WorkerSignals(QtCore.QObject):
+    done = QtCore.Signal(list)
+
+
+class _ReloadWorker(QtCore.QRunnable):
+    """Runs list_junk off the GUI thread and signals the rows back."""
+
+    def __init__(self, pool, query: str):
+        super().__init__()
+        self.pool = pool
+        self.query = query
+        self.signals = _WorkerSignals()
+
+    def run(self):
+        with self.pool.reader() as conn:
+            self.signals.done.emit(dbm.list_junk(conn, self.query))
+
+
+class JunkTab(QtWidgets.QWidget):
+    def __init__(self, pool, parent=None):
+        super().__init__(parent)
+        self.pool = pool
+        layout = QtWidgets.QVBoxLayout(self)
+
+        bar = QtWidgets.QHBoxLayout()
+        self.search = QtWidgets.QLineEdit()
+        self.search.setPlaceholderText("Filter by path…")
+        # Debounce keystrokes so we query once per pause, not per key.
+        self._search_timer = QtCore.QTimer(self)
+        self._search_timer.setSingleShot(True)
+        self._search_timer.setInterval(150)
+        self._search_timer.timeout.connect(self.reload)
+        self.search.textChanged.connect(self._search_timer.start)
+        bar.addWidget(self.search)
+        self.refresh_btn = QtWidgets.QPushButton("Refresh")
+        self.refresh_btn.clicked.connect(self.reload)
+        bar.addWidget(self.refresh_btn)
+        self.trash_btn = QtWidgets.QPushButton("Send to Trash")
+        self.trash_btn.clicked.connect(self.trash_selected)
+        bar.addWidget(self.trash_btn)
+        self.delete_btn = QtWidgets.QPushButton("Delete")
+        self.delete_btn.clicked.connect(self.delete_selected)
+        bar.addWidget(self.delete_btn)
+        layout.addLayout(bar)
+
+        self.model = JunkModel(self)
+        self.view = QtWidgets.QTableView()
+        self.view.setModel(self.model)
+        self.view.setSelectionBehavior(
+            QtWidgets.QAbstractItemView.SelectRows)
+        self.view.setSelectionMode(
+            QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.view.horizontalHeader().setStretchLastSection(True)
+        layout.addWidget(self.view)
+
+        self.status = QtWidgets.QLabel("")
+        layout.addWidget(self.status)
+
+        self.reload()
+
+    def reload(self) -> None:
+        worker = _ReloadWorker(self.pool, self.search.text())
+        worker.signals.done.connect(self._rows_loaded)
+        QtCore.QThreadPool.globalInstance().start(worker)
+
+    def _rows_loaded(self, rows: list) -> None:
+        self.model.set_rows(rows)
+        self.status.setText("%d junk candidates" % len(rows))
+
+    def _selected_paths(self) -> list[str]:
+        rows = {i.row() for i in self.view.selectionModel().selectedRows()}
+        return [self.model.row_path(r) for r in sorted(rows)]
+
+    def trash_selected(self) -> None:
+        if send2trash is None:
+            QtWidgets.QMessageBox.warning(
+                self, "Unavailable", "send2trash is not installed.")
+            return
+        for path in self._selected_paths():
+            try:
+                send2trash(path)
+            except OSError:
+                continue
+            dbm.delete_junk_entry(self.pool.writer(), path)
+            dbm.log_operation(self.pool.writer(), "trash", path)
+        self.reload()
+
+    def delete_selected(self) -> None:
+        paths = self._selected_paths()
+        if not paths:
+            return
+        answer = QtWidgets.QMessageBox.question(
+            self, "Delete", "Permanently delete %d files?" % len(paths))
+        if answer != QtWidgets.QMessageBox.Yes:
+            return
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            dbm.delete_junk_entry(self.pool.writer(), path)
+            dbm.log_operation(self.pool.writer(), "delete", path)
+        self.reload()
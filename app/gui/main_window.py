@@ -0,0 +1,1196 @@
+"""Main window: library, duplicates, junk, organize and settings tabs.
+
+Owns the ConnPool and the embedded ingest server; remote agents are
+driven over HTTP using the address configured in the Settings tab.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
+from pathlib import Path
+
+import requests
+from PySide6 import QtCore, QtGui, QtWidgets
+from requests.adapters import HTTPAdapter
+
+from app import db as dbm
+from app import ingest_server, organizer, scanner
+from app.gui.junk_tab import JunkTab
+from app.settings import Settings
+
+try:
+    from send2trash import send2trash
+except ImportError:
+    send2trash = None
+
+DB_PATH = Path("media_library.db")
+PREFS_PATH = Path("ui_prefs.json")
+
+LIB_HEADERS = ("Name", "Path", "Size", "Modified", "Ext", "Category",
+               "Duration", "Resolution", "Video", "Container", "Hashed",
+               "Show", "Season", "Episode", "Year", "Quality")
+DUP_HEADERS = ("Group", "Name", "Path", "Size", "Modified", "Duration",
+               "Status")
+
+CATEGORIES = ("All", "video", "image", "subtitle", "xml", "other",
+              "unknown")
+
+# Library keyset page size: one page is what the model holds per
+# fetchMore step, so refresh latency is constant in library size.
+LIB_PAGE = 1000
+
+
+class LibraryModel(QtCore.QAbstractTableModel):
+    """Viewport-sized model over pre-formatted library row tuples.
+
+    Search and category filtering happen in the SQL query, so the model
+    only ever holds the pages the user has scrolled to; fetchMore asks
+    the window for the next keyset page instead of the old
+    load-everything-then-filter-in-a-proxy arrangement.
+    """
+
+    more_requested = QtCore.Signal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows: list[tuple] = []
+        self._has_more = False
+
+    def reset_rows(self, rows: list[tuple], has_more: bool) -> None:
+        self.beginResetModel()
+        self._rows = rows
+        self._has_more = has_more
+        self.endResetModel()
+
+    def append_rows(self, rows: list[tuple], has_more: bool) -> None:
+        self._has_more = has_more
+        if not rows:
+            return
+        first = len(self._rows)
+        self.beginInsertRows(QtCore.QModelIndex(), first,
+                             first + len(rows) - 1)
+        self._rows.extend(rows)
+        self.endInsertRows()
+
+    def row_path(self, row: int) -> str:
+        return self._rows[row][1]
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return len(LIB_HEADERS)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and self._has_more
+
+    def fetchMore(self, parent):
+        if not parent.isValid() and self._has_more:
+            self.more_requested.emit()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        return self._rows[index.row()][index.column()]
+
+    def headerData(self, section, orientation,
+                   role=QtCore.Qt.DisplayRole):
+        if (orientation == QtCore.Qt.Horizontal
+                and role == QtCore.Qt.DisplayRole):
+            return LIB_HEADERS[section]
+        return None
+
+
+_HUMAN_UNITS = ("B", "KB", "MB", "GB", "TB", "PB")
+
+
+def human_size(n) -> str:
+    """Format a byte count; unit picked in O(1) from the bit length."""
+    n = int(n or 0)
+    idx = min(max(0, (n.bit_length() - 1) // 10), len(_HUMAN_UNITS) - 1)
+    return "%.1f %s" % (n / (1 << (10 * idx)), _HUMAN_UNITS[idx])
+
+
+def human_time(ts) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(ts or 0))
+
+
+class StatusPoller(QtCore.QObject):
+    """Polls ingest-server and agent stats on its own thread.
+
+    The HTTP calls and their timeouts happen here, not in the Qt event
+    loop; results cross back as queued signals, so a stalled agent can
+    no longer freeze the main window for the duration of a timeout.
+    The session keeps connections alive between ticks instead of paying
+    TCP setup every two seconds.
+    """
+
+    server_stats = QtCore.Signal(dict)
+    agent_stats = QtCore.Signal(dict)
+    cache_info = QtCore.Signal(dict)
+
+    INTERVAL_MS = 2000
+    # Fetch the (heavier) agent cache info every Nth tick only.
+    CACHE_INFO_EVERY = 15
+
+    def __init__(self, server_url: str, agent_url: str):
+        super().__init__()
+        # Plain attributes; the GUI thread updates agent_url when the
+        # settings change and the next tick picks it up.
+        self.server_url = server_url
+        self.agent_url = agent_url
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(
+            pool_connections=2, pool_maxsize=2, max_retries=0))
+        # The endpoints are polled concurrently so one slow host costs
+        # max(latencies) per tick, not the sum.
+        self._pool = ThreadPoolExecutor(max_workers=2)
+        self._tick = 0
+
+    @QtCore.Slot()
+    def start(self) -> None:
+        self._timer = QtCore.QTimer(self)
+        self._timer.setInterval(self.INTERVAL_MS)
+        self._timer.timeout.connect(self._poll)
+        self._timer.start()
+        self._poll()
+
+    def _fetch(self, url: str) -> dict:
+        try:
+            return self._session.get(url, timeout=1.0).json()
+        except Exception:
+            return {}
+
+    def _poll(self) -> None:
+        self._tick += 1
+        fs = {
+            self._pool.submit(
+                self._fetch, self.server_url + "/ingest/stats"):
+                self.server_stats,
+            self._pool.submit(
+                self._fetch, self.agent_url + "/agent/stats"):
+                self.agent_stats,
+        }
+        if self._tick % self.CACHE_INFO_EVERY == 1:
+            fs[self._pool.submit(
+                self._fetch, self.agent_url + "/agent/cache_info")] = \
+                self.cache_info
+        # Emit each result as it lands; a stalled endpoint delays only
+        # its own signal, and the whole tick is bounded by one timeout.
+        done, pending = futures_wait(fs, timeout=1.5)
+        for f in done:
+            fs[f].emit(f.result())
+        for f in pending:
+            fs[f].emit({})
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False)
+
+
+class ScanBridge(QtCore.QObject):
+    """Compressed scan-progress channel between worker and GUI thread.
+
+    The worker writes the latest counters and emits progress only when
+    no emission is already in flight, so a fast scan posts one queued
+    event at a time regardless of its rate instead of piling updates
+    into the Qt event queue. The slot reads whatever counters are
+    current when it runs, not what was current at emit time.
+    """
+
+    progress = QtCore.Signal()
+    finished = QtCore.Signal()
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._lock = threading.Lock()
+        self.done = 0
+        self.total = 0
+        self.junk = 0
+        self._pending = False
+
+    def update(self, done: int, total: int, junk: int) -> None:
+        """Called from the scan worker thread."""
+        with self._lock:
+            self.done = done
+            self.junk = junk
+            if total:
+                self.total = total
+            if self._pending:
+                return
+            self._pending = True
+        self.progress.emit()
+
+    def take(self) -> tuple[int, int, int]:
+        """Called from the GUI slot; clears the pending flag."""
+        with self._lock:
+            self._pending = False
+            return self.done, self.total, self.junk
+
+
+class DuplicatesModel(QtCore.QAbstractTableModel):
+    """Table model over pre-formatted duplicate row tuples.
+
+    Like LibraryModel, cells are plain strings in Python tuples —
+    nothing allocates a QStandardItem per cell, and a refresh is one
+    list swap under a model reset. Row backgrounds come from the
+    per-group brush list built alongside the rows.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._rows: list[tuple] = []
+        self._brushes: list = []
+
+    def set_rows(self, rows: list[tuple], brushes: list) -> None:
+        self.beginResetModel()
+        self._rows = rows
+        self._brushes = brushes
+        self.endResetModel()
+
+    def row_path(self, row: int) -> str:
+        return self._rows[row][2]
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return len(DUP_HEADERS)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole:
+            return self._rows[index.row()][index.column()]
+        if role == QtCore.Qt.BackgroundRole:
+            return self._brushes[index.row()]
+        return None
+
+    def headerData(self, section, orientation,
+                   role=QtCore.Qt.DisplayRole):
+        if (orientation == QtCore.Qt.Horizontal
+                and role == QtCore.Qt.DisplayRole):
+            return DUP_HEADERS[section]
+        return None
+
+
+class _LoaderSignals(QtCore.QObject):
+    done = QtCore.Signal(list)
+
+
+class _DeleteSignals(QtCore.QObject):
+    done = QtCore.Signal(str, list, list)
+
+
+class _DeleteWorker(QtCore.QRunnable):
+    """Trashes/unlinks a batch of files off the GUI thread.
+
+    The per-file syscalls are latency-bound and release the GIL, so a
+    small executor overlaps them; results come back in one signal
+    (succeeded paths plus per-file errors) so the window can commit the
+    DB updates in a single transaction and show one summary instead of
+    a message box per failure.
+    """
+
+    def __init__(self, paths: list[str], permanent: bool,
+                 max_workers: int = 4):
+        super().__init__()
+        self.paths = paths
+        self.permanent = permanent
+        # Sized by the user's worker setting: network shares want more
+        # in-flight unlinks, local disks fewer.
+        self.max_workers = max(1, max_workers)
+        self.signals = _DeleteSignals()
+
+    def _remove_one(self, path: str):
+        try:
+            if self.permanent:
+                os.remove(path)
+            elif send2trash is not None:
+                send2trash(path)
+            else:
+                raise OSError("send2trash is not installed")
+        except OSError as exc:
+            return path, str(exc)
+        return path, None
+
+    def run(self):
+        deleted: list[str] = []
+        errors: list[tuple[str, str]] = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for path, err in pool.map(self._remove_one, self.paths):
+                if err is None:
+                    deleted.append(path)
+                else:
+                    errors.append((path, err))
+        self.signals.done.emit(
+            "delete" if self.permanent else "trash", deleted, errors)
+
+
+class _LibraryLoader(QtCore.QRunnable):
+    """Materializes library rows into display strings off the GUI thread.
+
+    The DB fetch, filename parsing and size/time formatting are all
+    plain-Python work; only the resulting tuples of strings cross back
+    to the main thread, which installs them into the model. Borrows a
+    pooled reader, so a refresh never waits on a scan's transaction.
+    """
+
+    # Presentation tuples survive this many entries before the cache
+    # starts over; ~200k rows of small strings is a few hundred MB at
+    # worst and covers libraries far past what one window shows.
+    CACHE_CAP = 200_000
+
+    def __init__(self, pool, category, search, after_path, gen,
+                 row_cache, prev_sig=None):
+        super().__init__()
+        self.pool = pool
+        self.category = category
+        self.search = search
+        self.after_path = after_path
+        self.gen = gen
+        self.row_cache = row_cache
+        self.prev_sig = prev_sig
+        self.signals = _LoaderSignals()
+
+    def run(self):
+        out = []
+        # Files landed by the same scan pass share mtimes; strftime
+        # runs once per distinct stamp, not once per row.
+        mtime_strs: dict = {}
+        # Shared across refreshes: a row whose identity fields are
+        # unchanged reuses last refresh's display tuple instead of
+        # re-running the split/parse/format pipeline. full_hash and
+        # probed_at are part of the key because hashing and probing
+        # both finish after the file row lands and change displayed
+        # columns without touching mtime or size — probed_at covers
+        # Duration/Resolution/Video/Container in one stamp.
+        cache = self.row_cache
+        sig = None
+        with self.pool.reader() as conn:
+            if self.after_path is None:
+                # Full refreshes first compare a cheap aggregate of the
+                # filtered set against the last one; identical means
+                # the model's rows are still right and the fetch (and
+                # the reset it would trigger) is skipped.
+                sig = (self.category, self.search) + tuple(
+                    dbm.library_fingerprint(
+                        conn, kind=self.category, search=self.search))
+                if self.prev_sig is not None and sig == self.prev_sig:
+                    self.signals.done.emit([self.gen, None, None, sig])
+                    return
+            for row in dbm.fetch_library_rows(
+                    conn, kind=self.category, search=self.search,
+                    after_path=self.after_path, limit=LIB_PAGE):
+                (path, kind, size, mtime, full_hash, duration, width,
+                 height, vcodec, container, probed_at, size_str,
+                 tstr) = row
+                key = (path, mtime, size, full_hash, probed_at)
+                cached = cache.get(key)
+                if cached is not None:
+                    out.append(cached)
+                    continue
+                # Paths are stored POSIX-normalized; string splits beat
+                # constructing a PurePath per row just for the name.
+                parent, _, name = path.rpartition("/")
+                dot = name.rfind(".")
+                ext = name[dot:].lower() if dot > 0 else ""
+                # Both parsers memoize in the organizer module, so
+                # repeat names cost a dict lookup here.
+                parsed = (organizer.parse_filename(name)
+                          or organizer.parse_from_path(path) or {})
+                try:
+                    dur = "%.0fs" % float(duration)
+                except (TypeError, ValueError):
+                    dur = ""
+                res = ("%dx%d" % (width, height)
+                       if width and height else "")
+                if tstr is None:
+                    tstr = mtime_strs.get(mtime)
+                    if tstr is None:
+                        tstr = mtime_strs[mtime] = human_time(mtime)
+                values = (
+                    name, path, size_str or human_size(size), tstr,
+                    ext, kind, dur, res, vcodec or "",
+                    container or "", "yes" if full_hash else "",
+                    parsed.get("show") or "",
+                    str(parsed.get("season") or ""),
+                    str(parsed.get("episode") or ""),
+                    str(parsed.get("year") or ""),
+                    parsed.get("quality") or "")
+                if len(cache) >= self.CACHE_CAP:
+                    cache.clear()
+                cache[key] = values
+                out.append(values)
+        self.signals.done.emit([self.gen, self.after_path, out, sig])
+
+
+class MainWindow(QtWidgets.QMainWindow):
+    def __init__(self):
+        super().__init__()
+        self.setWindowTitle("Media Library Manager")
+        self.resize(1280, 800)
+        self.settings = self._load_prefs()
+        self._last_prefs_blob: bytes | None = None
+        # Rapid setting edits coalesce into one disk write per pause.
+        self._prefs_timer = QtCore.QTimer(self)
+        self._prefs_timer.setSingleShot(True)
+        self._prefs_timer.setInterval(250)
+        self._prefs_timer.timeout.connect(self._save_prefs)
+        # One keep-alive session for every agent/server call made from
+        # the GUI thread; the status poller keeps its own on its thread.
+        self._http = requests.Session()
+        self._http.mount("http://", HTTPAdapter(
+            pool_connections=4, pool_maxsize=4, max_retries=0))
+        self._agent_url = "http://%s:%d" % (self.settings.agent_ip,
+                                            self.settings.agent_port)
+        self.pool = dbm.ConnPool(DB_PATH)
+        self.conn = self.pool.writer()
+        self.ingest = ingest_server.start_ingest_server(
+            self.pool, port=self.settings.server_port,
+            config={"junk_patterns": self.settings.junk_patterns})
+
+        tabs = QtWidgets.QTabWidget()
+        tabs.addTab(self._build_library_tab(), "Library")
+        tabs.addTab(self._build_duplicates_tab(), "Duplicates")
+        self.junk_tab = JunkTab(self.pool)
+        tabs.addTab(self.junk_tab, "Junk")
+        tabs.addTab(self._build_organize_tab(), "Organize")
+        tabs.addTab(self._build_settings_tab(), "Settings")
+        self.setCentralWidget(tabs)
+
+        self._build_status_bar()
+        self._start_status_updates()
+
+        # Planner stats decay as scans land rows; refresh them whenever
+        # the app has been idle for a minute (analysis_limit keeps each
+        # pass bounded, see db.maintenance).
+        self._maint_timer = QtCore.QTimer(self)
+        self._maint_timer.setInterval(60_000)
+        self._maint_timer.timeout.connect(
+            lambda: dbm.maintenance(self.conn))
+        self._maint_timer.start()
+
+        self._scan_bridge = ScanBridge(self)
+        self._scan_bridge.progress.connect(self._on_scan_progress)
+        self._scan_bridge.finished.connect(self._scan_finished)
+        self._last_midscan_refresh = 0.0
+
+        self._refresh_library()
+        self._refresh_duplicates()
+
+    # ------------------------------------------------------------------
+    # Library tab
+
+    def _build_library_tab(self) -> QtWidgets.QWidget:
+        widget = QtWidgets.QWidget()
+        layout = QtWidgets.QVBoxLayout(widget)
+
+        bar = QtWidgets.QHBoxLayout()
+        self.search_edit = QtWidgets.QLineEdit()
+        self.search_edit.setPlaceholderText("Search path…")
+        bar.addWidget(self.search_edit)
+        self.combo_cat = QtWidgets.QComboBox()
+        self.combo_cat.addItems(CATEGORIES)
+        bar.addWidget(self.combo_cat)
+        btn_refresh = QtWidgets.QPushButton("Refresh")
+        btn_refresh.clicked.connect(self._refresh_library)
+        bar.addWidget(btn_refresh)
+        btn_add_root = QtWidgets.QPushButton("Add Root…")
+        btn_add_root.clicked.connect(self._act_add_root)
+        bar.addWidget(btn_add_root)
+        btn_scan = QtWidgets.QPushButton("Scan All Roots")
+        btn_scan.clicked.connect(self._start_local_roots_scan)
+        bar.addWidget(btn_scan)
+        layout.addLayout(bar)
+
+        self.lib_model = LibraryModel(self)
+        self.lib_model.more_requested.connect(self._load_next_lib_page)
+        self.table = QtWidgets.QTableView()
+        self.table.setModel(self.lib_model)
+        self.table.setSelectionBehavior(
+            QtWidgets.QAbstractItemView.SelectRows)
+        layout.addWidget(self.table)
+
+        self._lib_gen = 0
+        self._lib_cursor = None
+        self._lib_loading = False
+        # Display tuples keyed on row identity, shared with the page
+        # loaders; survives refreshes, dropped when roots change.
+        self._row_cache: dict = {}
+        self._lib_sig = None
+        self._lib_saved_cursor = None
+        # Debounce keystrokes/category flips into one SQL re-query per
+        # pause instead of one per event.
+        self._lib_timer = QtCore.QTimer(self)
+        self._lib_timer.setSingleShot(True)
+        self._lib_timer.setInterval(200)
+        self._lib_timer.timeout.connect(self._refresh_library)
+        self.search_edit.textChanged.connect(self._lib_timer.start)
+        self.combo_cat.currentTextChanged.connect(self._lib_timer.start)
+
+        self.lbl_library = QtWidgets.QLabel("")
+        layout.addWidget(self.lbl_library)
+        return widget
+
+    @QtCore.Slot()
+    def _refresh_library(self) -> None:
+        """Reload page one for the current search/category filters."""
+        self._lib_gen += 1
+        # Kept so an unchanged-fingerprint refresh can leave the model
+        # (and the user's scroll position) exactly where it was.
+        self._lib_saved_cursor = self._lib_cursor
+        self._lib_cursor = None
+        self._load_lib_page(after=None)
+
+    def _load_next_lib_page(self) -> None:
+        if not self._lib_loading and self._lib_cursor is not None:
+            self._load_lib_page(after=self._lib_cursor)
+
+    def _load_lib_page(self, after) -> None:
+        self._lib_loading = True
+        cat = self.combo_cat.currentText()
+        worker = _LibraryLoader(
+            self.pool, None if cat == "All" else cat,
+            self.search_edit.text(), after, self._lib_gen,
+            self._row_cache,
+            prev_sig=self._lib_sig if after is None else None)
+        worker.signals.done.connect(self._lib_page_ready)
+        QtCore.QThreadPool.globalInstance().start(worker)
+
+    def _lib_page_ready(self, result: list) -> None:
+        gen, after, rows, sig = result
+        self._lib_loading = False
+        if gen != self._lib_gen:
+            return  # stale page from before a filter change
+        if rows is None:
+            # Fingerprint matched: nothing changed, keep the model and
+            # paging state from before the refresh.
+            self._lib_cursor = self._lib_saved_cursor
+            return
+        if sig is not None:
+            self._lib_sig = sig
+        has_more = len(rows) >= LIB_PAGE
+        self._lib_cursor = rows[-1][1] if rows else None
+        if after is None:
+            self.lib_model.reset_rows(rows, has_more)
+        else:
+            self.lib_model.append_rows(rows, has_more)
+        count = self.lib_model.rowCount()
+        self.lbl_library.setText(
+            "%d files%s" % (count, "+" if has_more else ""))
+
+    # ------------------------------------------------------------------
+    # Duplicates tab
+
+    def _build_duplicates_tab(self) -> QtWidgets.QWidget:
+        widget = QtWidgets.QWidget()
+        layout = QtWidgets.QVBoxLayout(widget)
+
+        bar = QtWidgets.QHBoxLayout()
+        self.dup_search = QtWidgets.QLineEdit()
+        self.dup_search.setPlaceholderText("Filter by path…")
+        bar.addWidget(self.dup_search)
+        self.chk_suspected = QtWidgets.QCheckBox("Include suspected")
+        self.chk_suspected.setChecked(True)
+        self.chk_suspected.toggled.connect(self._refresh_duplicates)
+        bar.addWidget(self.chk_suspected)
+        btn_refresh = QtWidgets.QPushButton("Refresh")
+        btn_refresh.clicked.connect(self._refresh_duplicates)
+        bar.addWidget(btn_refresh)
+        btn_keep = QtWidgets.QPushButton("Keep Newest, Trash Others")
+        btn_keep.clicked.connect(self._act_keep_trash_others)
+        bar.addWidget(btn_keep)
+        btn_trash = QtWidgets.QPushButton("Trash Selected")
+        btn_trash.clicked.connect(
+            lambda: self._act_delete_selected(permanent=False))
+        bar.addWidget(btn_trash)
+        btn_delete = QtWidgets.QPushButton("Delete Selected")
+        btn_delete.clicked.connect(
+            lambda: self._act_delete_selected(permanent=True))
+        bar.addWidget(btn_delete)
+        layout.addLayout(bar)
+
+        self.dup_model = DuplicatesModel(self)
+        # Stock proxy filtering on the path column: the per-row match
+        # runs in Qt's C++ filter machinery, with no Python frame per
+        # row per keystroke.
+        self.dup_proxy = QtCore.QSortFilterProxyModel(self)
+        self.dup_proxy.setSourceModel(self.dup_model)
+        self.dup_proxy.setFilterKeyColumn(2)
+        self.dup_proxy.setRecursiveFilteringEnabled(False)
+        self.dup_table = QtWidgets.QTableView()
+        self.dup_table.setModel(self.dup_proxy)
+        self.dup_table.setSelectionBehavior(
+            QtWidgets.QAbstractItemView.SelectRows)
+        self.dup_table.setSelectionMode(
+            QtWidgets.QAbstractItemView.ExtendedSelection)
+        layout.addWidget(self.dup_table)
+
+        # Debounced like the library search: one proxy invalidation per
+        # typing pause rather than one full filter pass per keystroke.
+        self._dup_timer = QtCore.QTimer(self)
+        self._dup_timer.setSingleShot(True)
+        self._dup_timer.setInterval(200)
+        self._dup_timer.timeout.connect(
+            lambda: self._set_dup_filter(self.dup_search.text()))
+        self.dup_search.textChanged.connect(self._dup_timer.start)
+
+        self._dup_sig = None
+        self._dup_group_index: dict = {}
+        self._dup_path_to_group: dict = {}
+        self._dup_paths: frozenset = frozenset()
+        self.lbl_duplicates = QtWidgets.QLabel("")
+        layout.addWidget(self.lbl_duplicates)
+        self.lbl_dup_stats = QtWidgets.QLabel("")
+        layout.addWidget(self.lbl_dup_stats)
+        return widget
+
+    def _set_dup_filter(self, text: str) -> None:
+        self.dup_proxy.setFilterRegularExpression(
+            QtCore.QRegularExpression(
+                QtCore.QRegularExpression.escape(text),
+                QtCore.QRegularExpression.CaseInsensitiveOption))
+
+    def _color_for_group(self, key: str) -> QtGui.QColor:
+        # blake2s at 2 bytes is plenty: the digest only seeds a hue, so
+        # cryptographic strength buys nothing here.
+        digest = hashlib.blake2s(key.encode("utf-8"),
+                                 digest_size=2).digest()
+        hue = int.from_bytes(digest, "little") % 360
+        return QtGui.QColor.fromHsv(hue, 40, 250)
+
+    def _refresh_duplicates(self) -> None:
+        include_suspected = self.chk_suspected.isChecked()
+        with self.pool.reader() as conn:
+            group_rows = dbm.fetch_duplicate_groups(
+                conn, include_suspected=include_suspected)
+            # The aggregates double as a change fingerprint: same
+            # groups, members and waste — plus an unchanged metadata
+            # count and newest probe stamp, which cover Duration cells
+            # filling in for otherwise-unchanged files — means the
+            # member rows are the same too, so skip refetching and
+            # rebuilding the model.
+            sig = (include_suspected, len(group_rows),
+                   sum(n for (_g, n, _s, _w) in group_rows),
+                   sum(w for (_g, _n, _s, w) in group_rows)) + tuple(
+                dbm.duplicate_metadata_fingerprint(
+                    conn, include_suspected=include_suspected))
+            if sig == self._dup_sig:
+                return
+            rows = dbm.fetch_duplicate_rows(
+                conn, include_suspected=include_suspected)
+        self._dup_sig = sig
+
+        values_rows: list[tuple] = []
+        brushes: list = []
+        mtime_strs: dict = {}
+        # One brush per group, not one QColor hash per row: group keys
+        # repeat for every member.
+        group_brushes: dict = {}
+        # Group membership with the DB mtimes, for keep-newest: built
+        # here so the action never walks the model or stats files.
+        group_index: dict[str, list[tuple[float, str]]] = {}
+        # Path-to-group map shared with the organize preview, so an
+        # Analyze click doesn't refetch every duplicate row.
+        path_to_group: dict[str, str] = {}
+        for row in rows:
+            (gkey, path, size, mtime, duration, confirmed,
+             size_str, tstr) = row
+            name = path.rpartition("/")[2]
+            group_index.setdefault(gkey, []).append((mtime or 0.0, path))
+            path_to_group[path] = gkey
+            try:
+                dur = "%.0fs" % float(duration)
+            except (TypeError, ValueError):
+                dur = ""
+            if tstr is None:
+                tstr = mtime_strs.get(mtime)
+                if tstr is None:
+                    tstr = mtime_strs[mtime] = human_time(mtime)
+            values_rows.append(
+                (gkey, name, path, size_str or human_size(size), tstr,
+                 dur, "confirmed" if confirmed else "suspected"))
+            bg = group_brushes.get(gkey)
+            if bg is None:
+                bg = group_brushes[gkey] = QtGui.QBrush(
+                    self._color_for_group(gkey))
+            brushes.append(bg)
+        self.dup_model.set_rows(values_rows, brushes)
+        self._dup_group_index = group_index
+        self._dup_path_to_group = path_to_group
+        self._dup_paths = frozenset(path_to_group)
+
+        # The stats come from the SQL aggregate, not a Python pass over
+        # the member rows.
+        dup_files = sum(n - 1 for (_g, n, _s, _w) in group_rows)
+        wasted = sum(w for (_g, _n, _s, w) in group_rows)
+        self.lbl_duplicates.setText(
+            "%d groups, %d redundant files" % (len(group_rows), dup_files))
+        self.lbl_dup_stats.setText("%s reclaimable" % human_size(wasted))
+
+    def _selected_dup_paths(self) -> list[str]:
+        paths = []
+        for index in self.dup_table.selectionModel().selectedRows():
+            src = self.dup_proxy.mapToSource(index)
+            paths.append(self.dup_model.row_path(src.row()))
+        return paths
+
+    def _act_delete_selected(self, permanent: bool) -> None:
+        paths = self._selected_dup_paths()
+        if not paths:
+            return
+        verb = "Permanently delete" if permanent else "Send to trash"
+        answer = QtWidgets.QMessageBox.question(
+            self, "Confirm", "%s %d files?" % (verb, len(paths)))
+        if answer != QtWidgets.QMessageBox.Yes:
+            return
+        self._perform_delete(paths, permanent)
+
+    def _act_keep_trash_others(self) -> None:
+        # Group membership comes from the index the refresh built, not
+        # a per-cell walk of the model (two Qt round trips per row) or
+        # a stat call per file.
+        to_trash = []
+        for members in self._dup_group_index.values():
+            if len(members) < 2:
+                continue
+            ordered = sorted(members, reverse=True)
+            to_trash.extend(path for _mtime, path in ordered[1:])
+        if not to_trash:
+            return
+        answer = QtWidgets.QMessageBox.question(
+            self, "Confirm",
+            "Send %d older duplicates to trash?" % len(to_trash))
+        if answer != QtWidgets.QMessageBox.Yes:
+            return
+        self._perform_delete(to_trash, permanent=False)
+
+    def _perform_delete(self, paths: list[str], permanent: bool) -> None:
+        worker = _DeleteWorker(paths, permanent,
+                               max_workers=self.settings.max_workers)
+        worker.signals.done.connect(self._delete_finished)
+        QtCore.QThreadPool.globalInstance().start(worker)
+
+    def _delete_finished(self, op: str, deleted: list,
+                         errors: list) -> None:
+        if deleted:
+            # One commit for the whole batch instead of one per file;
+            # the log rows ride in the same transaction.
+            with dbm.write_transaction(self.conn):
+                dbm.delete_file_entries(self.conn, deleted)
+                dbm.log_operations(
+                    self.conn, [(op, p, None, None) for p in deleted])
+        if errors:
+            QtWidgets.QMessageBox.warning(
+                self, "Some deletions failed",
+                "\n".join("%s: %s" % e for e in errors[:20])
+                + ("\n…" if len(errors) > 20 else ""))
+        self._refresh_duplicates()
+        self._refresh_library()
+
+    # ------------------------------------------------------------------
+    # Scans
+
+    def _act_add_root(self) -> None:
+        root = QtWidgets.QFileDialog.getExistingDirectory(
+            self, "Choose a library root")
+        if not root:
+            return
+        dbm.add_root(self.conn, root)
+        self._row_cache.clear()
+        self._start_scan(root)
+
+    def _start_scan(self, root: str) -> None:
+        """Scan one root on a worker thread."""
+        self._run_scan_worker([root], "scan-root")
+
+    def _start_local_roots_scan(self) -> None:
+        roots = dbm.enabled_roots(self.conn)
+        if not roots:
+            QtWidgets.QMessageBox.information(
+                self, "No roots", "Add a library root first.")
+            return
+        self._run_scan_worker(roots, "scan-roots")
+
+    def _run_scan_worker(self, roots: list[str], name: str) -> None:
+        bridge = self._scan_bridge
+
+        def progress_cb(done, total, junk):
+            bridge.update(done, total, junk)
+
+        def worker():
+            # Last scan's per-root counts stand in for the total; a
+            # pre-count would double the traversal I/O just to size a
+            # progress bar. The bar stays busy-indeterminate on a first
+            # scan and corrects itself as the walk overtakes it.
+            known = sum(dbm.count_files_under_root(self.conn, r)
+                        for r in roots)
+            if known:
+                bridge.update(0, known, 0)
+            scanner.scan(self.conn, roots, self.settings, progress_cb)
+            bridge.finished.emit()
+
+        self.pb_local.setRange(0, 0)
+        threading.Thread(target=worker, name=name, daemon=True).start()
+
+    @QtCore.Slot()
+    def _on_scan_progress(self) -> None:
+        done, total, _junk = self._scan_bridge.take()
+        if total and self.pb_local.maximum() <= 1:
+            self.pb_local.setRange(0, total)
+        maximum = self.pb_local.maximum()
+        if maximum > 1 and done > maximum:
+            # The library grew past the previous scan's estimate.
+            self.pb_local.setMaximum(done)
+        self.pb_local.setValue(done)
+        now = time.monotonic()
+        if now - self._last_midscan_refresh >= 2.0:
+            self._last_midscan_refresh = now
+            self._refresh_library()
+
+    @QtCore.Slot()
+    def _scan_finished(self) -> None:
+        self.pb_local.setRange(0, 1)
+        self.pb_local.setValue(1)
+        dbm.maintenance(self.conn)
+        self._refresh_library()
+        self._refresh_duplicates()
+        self.junk_tab.reload()
+
+    # ------------------------------------------------------------------
+    # Remote agent
+
+    def _agent_base(self) -> str:
+        # Pre-formatted once per settings edit, not per call.
+        return self._agent_url
+
+    def _start_remote_scan(self) -> None:
+        try:
+            self._http.post(self._agent_base() + "/agent/scan",
+                            timeout=2.0)
+        except Exception as exc:
+            QtWidgets.QMessageBox.warning(self, "Agent", str(exc))
+            return
+        self.statusBar().showMessage("Remote scan requested", 5000)
+
+    def _show_agent_cache_info(self) -> None:
+        try:
+            r = self._http.get(self._agent_base() + "/agent/cache_info",
+                               timeout=2.0)
+            info = r.json()
+        except Exception as exc:
+            QtWidgets.QMessageBox.warning(self, "Agent", str(exc))
+            return
+        QtWidgets.QMessageBox.information(
+            self, "Agent cache",
+            "\n".join("%s: %s" % kv for kv in sorted(info.items())))
+
+    def _clear_agent_cache(self) -> None:
+        try:
+            self._http.post(self._agent_base() + "/agent/clear_cache",
+                            timeout=2.0)
+        except Exception as exc:
+            QtWidgets.QMessageBox.warning(self, "Agent", str(exc))
+            return
+        self.statusBar().showMessage("Agent cache cleared", 5000)
+
+    # ------------------------------------------------------------------
+    # Status bar
+
+    def _build_status_bar(self) -> None:
+        bar = self.statusBar()
+        self.pb_local = QtWidgets.QProgressBar()
+        self.pb_local.setMaximumWidth(220)
+        self.pb_local.setRange(0, 1)
+        bar.addPermanentWidget(self.pb_local)
+        self.lbl_server = QtWidgets.QLabel("server: –")
+        bar.addPermanentWidget(self.lbl_server)
+        self.lbl_agent = QtWidgets.QLabel("agent: –")
+        bar.addPermanentWidget(self.lbl_agent)
+
+    def _start_status_updates(self) -> None:
+        self._poller = StatusPoller(
+            "http://127.0.0.1:%d" % self.settings.server_port,
+            self._agent_base())
+        self._poller_thread = QtCore.QThread(self)
+        self._poller.moveToThread(self._poller_thread)
+        self._poller_thread.started.connect(self._poller.start)
+        self._poller.server_stats.connect(self._set_server_stats)
+        self._poller.agent_stats.connect(self._set_agent_stats)
+        self._poller.cache_info.connect(self._set_agent_cache_info)
+        self._poller_thread.start()
+
+    @QtCore.Slot(dict)
+    def _set_server_stats(self, stats: dict) -> None:
+        if stats:
+            self.lbl_server.setText(
+                "server: %d batches / %d files"
+                % (stats.get("batches", 0), stats.get("files", 0)))
+        else:
+            self.lbl_server.setText("server: –")
+
+    @QtCore.Slot(dict)
+    def _set_agent_stats(self, stats: dict) -> None:
+        if stats:
+            self.lbl_agent.setText(
+                "agent: %d videos" % stats.get("seen_videos", 0))
+        else:
+            self.lbl_agent.setText("agent: offline")
+
+    @QtCore.Slot(dict)
+    def _set_agent_cache_info(self, info: dict) -> None:
+        if info:
+            self.lbl_agent.setToolTip(
+                "\n".join("%s: %s" % kv for kv in sorted(info.items())))
+
+    # ------------------------------------------------------------------
+    # Organize tab
+
+    def _build_organize_tab(self) -> QtWidgets.QWidget:
+        widget = QtWidgets.QWidget()
+        layout = QtWidgets.QVBoxLayout(widget)
+
+        bar = QtWidgets.QHBoxLayout()
+        bar.addWidget(QtWidgets.QLabel("Root filter:"))
+        self.edit_org_root = QtWidgets.QLineEdit()
+        bar.addWidget(self.edit_org_root)
+        btn_analyze = QtWidgets.QPushButton("Analyze")
+        btn_analyze.clicked.connect(self._preview_org)
+        bar.addWidget(btn_analyze)
+        btn_apply = QtWidgets.QPushButton("Apply Renames")
+        btn_apply.clicked.connect(self._apply_org)
+        bar.addWidget(btn_apply)
+        layout.addLayout(bar)
+
+        pat = QtWidgets.QHBoxLayout()
+        pat.addWidget(QtWidgets.QLabel("Pattern:"))
+        self.edit_pattern = QtWidgets.QLineEdit(
+            self.settings.naming_pattern)
+        # Debounced like the search fields: one demo render per typing
+        # pause, not one per keystroke.
+        self._pat_timer = QtCore.QTimer(self)
+        self._pat_timer.setSingleShot(True)
+        self._pat_timer.setInterval(150)
+        self._pat_timer.timeout.connect(self._do_pattern_changed)
+        self.edit_pattern.textChanged.connect(self._pat_timer.start)
+        pat.addWidget(self.edit_pattern)
+        self.lbl_pattern_demo = QtWidgets.QLabel("")
+        pat.addWidget(self.lbl_pattern_demo)
+        layout.addLayout(pat)
+
+        self.org_model = QtGui.QStandardItemModel(self)
+        self.org_model.setHorizontalHeaderLabels(
+            ("Path", "Proposed", "Duplicate"))
+        self.org_table = QtWidgets.QTableView()
+        self.org_table.setModel(self.org_model)
+        layout.addWidget(self.org_table)
+
+        self.lbl_org = QtWidgets.QLabel("")
+        layout.addWidget(self.lbl_org)
+        return widget
+
+    @QtCore.Slot()
+    def _do_pattern_changed(self) -> None:
+        text = self.edit_pattern.text()
+        self.settings.naming_pattern = text
+        demo = organizer.propose_path(
+            {"show": "Show", "season": 1, "episode": 2, "date": None,
+             "year": None, "quality": None}, text, ".mkv")
+        self.lbl_pattern_demo.setText(demo or "invalid pattern")
+        self._prefs_timer.start()
+
+    # Every cell of one duplicate proposal row shares this brush.
+    _ORG_DUP_BRUSH = None
+
+    def _preview_org(self) -> None:
+        root = self.edit_org_root.text().strip()
+        # Root filtering happens in SQLite as an index range seek; no
+        # per-row Python substring test over the whole library. The
+        # generator streams, so no path list is materialized either.
+        paths = dbm.fetch_library_paths(self.conn, root or None)
+        # Duplicate membership comes from the map the duplicates
+        # refresh maintains; no refetch of every duplicate row per
+        # Analyze click. It reflects that tab's suspected toggle.
+        dup_map = self._dup_path_to_group
+        dup_paths = self._dup_paths
+        if MainWindow._ORG_DUP_BRUSH is None:
+            MainWindow._ORG_DUP_BRUSH = QtGui.QBrush(
+                QtGui.QColor(255, 235, 205))
+        pattern = self.edit_pattern.text()
+        # Collect first, install second: the model hears nothing while
+        # rows land, the view relayouts once at the end instead of per
+        # appendRow.
+        proposals: list[tuple[str, str, str | None]] = []
+        for i, path in enumerate(paths, 1):
+            # Let the window keep painting during a big analysis;
+            # user input stays queued so the model isn't mutated
+            # under us.
+            if i % 2000 == 0:
+                QtWidgets.QApplication.processEvents(
+                    QtCore.QEventLoop.ExcludeUserInputEvents)
+            p = Path(path)
+            parsed = (organizer.parse_filename(p.name)
+                      or organizer.parse_from_path(p))
+            if parsed is None:
+                continue
+            new_rel = organizer.propose_path(parsed, pattern, p.suffix)
+            if new_rel is None:
+                continue
+            proposals.append(
+                (path, new_rel,
+                 dup_map[path] if path in dup_paths else None))
+        model = self.org_model
+        self.org_table.setUpdatesEnabled(False)
+        model.blockSignals(True)
+        try:
+            model.setRowCount(0)
+            model.setRowCount(len(proposals))
+            for r, (path, new_rel, gkey) in enumerate(proposals):
+                items = (QtGui.QStandardItem(path),
+                         QtGui.QStandardItem(new_rel),
+                         QtGui.QStandardItem(gkey or ""))
+                for c, item in enumerate(items):
+                    if gkey is not None:
+                        item.setBackground(MainWindow._ORG_DUP_BRUSH)
+                    model.setItem(r, c, item)
+        finally:
+            model.blockSignals(False)
+            model.layoutChanged.emit()
+            self.org_table.setUpdatesEnabled(True)
+        self.lbl_org.setText("%d rename proposals" % len(proposals))
+
+    def _apply_org(self) -> None:
+        count = self.org_model.rowCount()
+        if not count:
+            return
+        answer = QtWidgets.QMessageBox.question(
+            self, "Apply", "Apply %d renames?" % count)
+        if answer != QtWidgets.QMessageBox.Yes:
+            return
+        now = time.time()
+        applied = 0
+        for row in range(count):
+            src = self.org_model.item(row, 0).text()
+            rel = self.org_model.item(row, 1).text()
+            root = self.edit_org_root.text().strip() or str(Path(src).parent)
+            dst = str(Path(root) / rel)
+            try:
+                os.makedirs(os.path.dirname(dst), exist_ok=True)
+                shutil.move(src, dst)
+            except OSError as exc:
+                QtWidgets.QMessageBox.warning(
+                    self, "Failed", "%s: %s" % (src, exc))
+                continue
+            with dbm.write_transaction(self.conn):
+                dbm.delete_file_entry(self.conn, src)
+                try:
+                    st = os.stat(dst)
+                    dbm.upsert_file(self.conn, dst, "video", st.st_size,
+                                    st.st_mtime, now)
+                except OSError:
+                    pass
+            dbm.log_operation(self.conn, "move", src, dst)
+            applied += 1
+        self.lbl_org.setText("%d renames applied" % applied)
+        self._refresh_library()
+
+    # ------------------------------------------------------------------
+    # Settings tab
+
+    def _build_settings_tab(self) -> QtWidgets.QWidget:
+        widget = QtWidgets.QWidget()
+        form = QtWidgets.QFormLayout(widget)
+
+        self.edit_agent_ip = QtWidgets.QLineEdit(self.settings.agent_ip)
+        self.edit_agent_ip.editingFinished.connect(self._prefs_edited)
+        form.addRow("Agent address", self.edit_agent_ip)
+
+        self.spin_workers = QtWidgets.QSpinBox()
+        self.spin_workers.setRange(1, 32)
+        self.spin_workers.setValue(self.settings.max_workers)
+        self.spin_workers.valueChanged.connect(self._prefs_edited)
+        form.addRow("Hash workers", self.spin_workers)
+
+        self.edit_media_exts = QtWidgets.QLineEdit(
+            " ".join(self.settings.video_exts))
+        self.edit_media_exts.editingFinished.connect(self._prefs_edited)
+        form.addRow("Video extensions", self.edit_media_exts)
+
+        self.edit_junk_patterns = QtWidgets.QLineEdit(
+            " ".join(self.settings.junk_patterns))
+        self.edit_junk_patterns.editingFinished.connect(self._prefs_edited)
+        form.addRow("Junk patterns", self.edit_junk_patterns)
+
+        btn_cache_info = QtWidgets.QPushButton("Agent Cache Info")
+        btn_cache_info.clicked.connect(self._show_agent_cache_info)
+        form.addRow(btn_cache_info)
+        btn_clear_cache = QtWidgets.QPushButton("Clear Agent Cache")
+        btn_clear_cache.clicked.connect(self._clear_agent_cache)
+        form.addRow(btn_clear_cache)
+        btn_remote = QtWidgets.QPushButton("Start Remote Scan")
+        btn_remote.clicked.connect(self._start_remote_scan)
+        form.addRow(btn_remote)
+        return widget
+
+    def _prefs_edited(self, *_args) -> None:
+        self.settings.agent_ip = self.edit_agent_ip.text().strip()
+        self.settings.max_workers = self.spin_workers.value()
+        self.settings.video_exts = self.edit_media_exts.text().split()
+        self.settings.junk_patterns = self.edit_junk_patterns.text().split()
+        self._agent_url = "http://%s:%d" % (self.settings.agent_ip,
+                                            self.settings.agent_port)
+        self._poller.agent_url = self._agent_url
+        self._prefs_timer.start()
+
+    def _load_prefs(self) -> Settings:
+        try:
+            return Settings.from_dict(
+                json.loads(PREFS_PATH.read_text(encoding="utf-8")))
+        except (OSError, ValueError):
+            return Settings()
+
+    def _save_prefs(self) -> None:
+        """Write prefs atomically, and only when something changed.
+
+        Comparing serialized bytes catches no-op edits (retyping the
+        same value, editingFinished on an untouched field); the
+        tmp-then-replace dance means a crash mid-write never leaves a
+        truncated prefs file behind.
+        """
+        blob = json.dumps(self.settings.to_dict(), indent=2,
+                          sort_keys=True).encode("utf-8")
+        if blob == self._last_prefs_blob:
+            return
+        tmp = PREFS_PATH.with_suffix(".json.tmp")
+        tmp.write_bytes(blob)
+        os.replace(tmp, PREFS_PATH)
+        self._last_prefs_blob = blob
+
+    # ------------------------------------------------------------------
+
+    def closeEvent(self, event) -> None:
+        self._poller_thread.quit()
+        self._poller_thread.wait(3000)
+        self._poller.shutdown()
+        self._maint_timer.stop()
+        self.ingest.shutdown()
+        self._prefs_timer.stop()
+        self._save_prefs()
+        self.pool.close()
+        super().closeEvent(event)
+
+
+def main(argv=None) -> int:
+    app = QtWidgets.QApplication(argv or sys.argv)
+    window = MainWindow()
+    window.show()
+    return app.exec()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,187 @@
+"""HTTP ingest endpoint for remote scan agents.
+
+Receives the batches agent.py POSTs to /ingest/batch (optionally
+gzip'd), applies them to the library database through the shared
+ConnPool's writer, and serves /ingest/config (config overrides pushed
+to agents) and /ingest/stats (counters for the GUI status bar).
+"""
+
+from __future__ import annotations
+
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Optional
+
+from app import db as dbm
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_stats = {
+    "batches": 0,
+    "items": 0,
+    "files": 0,
+    "junk": 0,
+    "errors": 0,
+    "last_batch_at": 0.0,
+}
+_stats_lock = threading.Lock()
+
+
+
+def get_ingest_stats() -> dict[str, Any]:
+    with _stats_lock:
+        return dict(_stats)
+
+
+def _probe_fields(probe: dict) -> tuple:
+    """(duration, width, height, video_codec, audio_codec, container)
+    pulled out of one ffprobe document."""
+    fmt = probe.get("format") or {}
+    duration = fmt.get("duration")
+    try:
+        duration = float(duration) if duration is not None else None
+    except (TypeError, ValueError):
+        duration = None
+    width = height = vcodec = acodec = None
+    for stream in probe.get("streams") or ():
+        ctype = stream.get("codec_type")
+        if ctype == "video" and vcodec is None:
+            vcodec = stream.get("codec_name")
+            width = stream.get("width")
+            height = stream.get("height")
+        elif ctype == "audio" and acodec is None:
+            acodec = stream.get("codec_name")
+    return (duration, width, height, vcodec, acodec,
+            fmt.get("format_name"))
+
+
+def apply_batch(conn, payload: dict) -> int:
+    """Apply one agent batch: files, junk, hashes and probe metadata."""
+    items = payload.get("items") or []
+    now = time.time()
+    file_rows: list[tuple] = []
+    junk_items: list[dict] = []
+    enriched: list[dict] = []
+    for item in items:
+        if item.get("kind") == "junk":
+            junk_items.append(item)
+            continue
+        file_rows.append((item["path"], item["kind"], item["size"],
+                          item["mtime"], now, now))
+        if item.get("hashes") or item.get("probe"):
+            enriched.append(item)
+    # The writer connection is shared with the GUI and scan threads;
+    # db.write_transaction holds its per-connection write lock, so a
+    # batch applies as one transaction no other thread can interleave.
+    with dbm.write_transaction(conn):
+        if enriched:
+            ids = dbm.upsert_files_many_ids(conn, file_rows)
+        else:
+            dbm.upsert_files_many(conn, file_rows)
+            ids = {}
+        hash_rows: list[tuple] = []
+        meta_rows: list[tuple] = []
+        for item in enriched:
+            file_id = ids.get(dbm.normalize_path(item["path"]))
+            if file_id is None:
+                continue
+            hashes = item.get("hashes")
+            if hashes:
+                hash_rows.append((file_id, hashes["algo"],
+                                  hashes["sample_size"],
+                                  hashes["sample_hash"],
+                                  hashes.get("full_hash"), now))
+            probe = item.get("probe")
+            if probe:
+                meta_rows.append(
+                    (file_id,) + _probe_fields(probe)
+                    + (now, dbm.compress_streams(json.dumps(probe))))
+        if hash_rows:
+            dbm.upsert_hashes_many(conn, hash_rows)
+        if meta_rows:
+            dbm.upsert_metadata_many(conn, meta_rows)
+        for item in junk_items:
+            path = item["path"]
+            # Ext from the basename with the walker's dot > 0 rule: a
+            # dot in a directory name must not leak in, and a leading
+            # dot alone (dotfiles) doesn't make one.
+            name = path.replace("\\", "/").rsplit("/", 1)[-1].lower()
+            dot = name.rfind(".")
+            dbm.upsert_junk(conn, path, item["size"], item["mtime"],
+                            name[dot:] if dot > 0 else "",
+                            item.get("junk_pattern") or "junk", now)
+    with _stats_lock:
+        _stats["batches"] += 1
+        _stats["items"] += len(items)
+        _stats["files"] += len(file_rows)
+        _stats["junk"] += len(junk_items)
+        _stats["last_batch_at"] = now
+    return len(items)
+
+
+class IngestServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, addr, pool, config: Optional[dict] = None):
+        super().__init__(addr, _IngestHandler)
+        self.pool = pool
+        self.config = config or {}
+
+
+class _IngestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):  # quiet; stats carry the signal
+        pass
+
+    def _send_json(self, obj: Any, status: int = 200) -> None:
+        body = (orjson.dumps(obj) if orjson is not None
+                else json.dumps(obj).encode("utf-8"))
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/ingest/stats":
+            self._send_json(get_ingest_stats())
+        elif self.path == "/ingest/config":
+            self._send_json(self.server.config)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if self.path != "/ingest/batch":
+            self._send_json({"error": "not found"}, 404)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length)
+        if self.headers.get("Content-Encoding") == "gzip":
+            body = gzip.decompress(body)
+        try:
+            payload = (orjson.loads(body) if orjson is not None
+                       else json.loads(body))
+            applied = apply_batch(self.server.pool.writer(), payload)
+        except Exception as exc:
+            with _stats_lock:
+                _stats["errors"] += 1
+            self._send_json({"error": str(exc)}, 400)
+            return
+        self._send_json({"ok": True, "applied": applied})
+
+
+def start_ingest_server(pool, host: str = "0.0.0.0", port: int = 8765,
+                        config: Optional[dict] = None) -> IngestServer:
+    """Start the ingest endpoint on a daemon thread and return it."""
+    server = IngestServer((host, port), pool, config)
+    thread = threading.Thread(target=server.serve_forever,
+                              name="ingest-server", daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,196 @@
+"""Local filesystem scanner feeding the library database.
+
+The remote agent (agent.py) does the same walk on other machines and
+ships batches over HTTP; this module is the in-process equivalent for
+roots mounted on the GUI host. Classification follows the agent's
+scheme: one {ext: kind} dict plus a single compiled junk regex, so the
+per-file cost is a dict lookup and one regex match.
+"""
+
+from __future__ import annotations
+
+import fnmatch
+import hashlib
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Iterator, Optional
+
+from app import db as dbm
+from app.settings import Settings
+
+BATCH_SIZE = 1000
+
+ProgressCb = Callable[[int, int, int], None]
+
+
+@dataclass
+class ScanResult:
+    files: int = 0
+    videos: int = 0
+    junk: int = 0
+    hashed: int = 0
+    errors: list = field(default_factory=list)
+
+
+def _ext_kind_map(settings: Settings) -> dict[str, str]:
+    ext_kind: dict[str, str] = {}
+    for exts, kind in ((settings.video_exts, "video"),
+                       (settings.image_exts, "image"),
+                       (settings.subtitle_exts, "subtitle"),
+                       (settings.xml_exts, "xml"),
+                       (settings.other_exts, "other")):
+        for ext in exts:
+            ext_kind.setdefault(ext.lower(), kind)
+    return ext_kind
+
+
+def _junk_re(settings: Settings) -> Optional[re.Pattern]:
+    if not settings.junk_patterns:
+        return None
+    # Named groups recover which pattern matched without testing each
+    # one individually, same trick as the agent's iter_files.
+    return re.compile("|".join(
+        "(?P<p%d>%s)" % (i, fnmatch.translate(p.lower()))
+        for i, p in enumerate(settings.junk_patterns)))
+
+
+def iter_media_files(roots: list[str], settings: Settings
+                     ) -> Iterator[tuple[str, str, int, float,
+                                         Optional[str]]]:
+    """Yield (kind, path, size, mtime, junk_pattern) for files under roots.
+
+    kind is "junk" for junk-pattern matches; junk_pattern is then the
+    pattern that matched. Unreadable entries are skipped silently (the
+    scan pass reports totals, not per-file errors).
+    """
+    ext_kind = _ext_kind_map(settings)
+    kind_for = ext_kind.get
+    junk_re = _junk_re(settings)
+    junk_match = junk_re.match if junk_re is not None else None
+    junk_exclude = frozenset(e.lower() for e in settings.junk_exclude_exts)
+    patterns = settings.junk_patterns
+    stack = [str(r) for r in roots]
+    while stack:
+        top = stack.pop()
+        try:
+            entries = os.scandir(top)
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=settings.follow_links):
+                        stack.append(entry.path)
+                        continue
+                    if not entry.is_file(
+                            follow_symlinks=settings.follow_links):
+                        continue
+                    st = entry.stat(follow_symlinks=settings.follow_links)
+                except OSError:
+                    continue
+                lower = entry.name.lower()
+                dot = lower.rfind(".")
+                ext = lower[dot:] if dot > 0 else ""
+                if junk_match is not None:
+                    m = junk_match(lower)
+                    if m is not None and ext not in junk_exclude:
+                        yield ("junk", entry.path, st.st_size, st.st_mtime,
+                               patterns[int(m.lastgroup[1:])])
+                        continue
+                yield (kind_for(ext, "unknown"), entry.path, st.st_size,
+                       st.st_mtime, None)
+
+
+def _hash_file(path: str, size: int, settings: Settings
+               ) -> tuple[Optional[str], Optional[str]]:
+    """(sample_hash, full_hash) for one file; full only under the cap."""
+    sample = hashlib.new(settings.hash_algo)
+    try:
+        with open(path, "rb") as f:
+            sample.update(f.read(settings.sample_size))
+            if size > settings.full_hash_max_bytes:
+                return sample.hexdigest(), None
+            full = hashlib.new(settings.hash_algo)
+            f.seek(0)
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                full.update(chunk)
+    except OSError:
+        return None, None
+    return sample.hexdigest(), full.hexdigest()
+
+
+_UNHASHED_VIDEOS_SQL = (
+    "SELECT f.id, f.path, f.size FROM files f "
+    "LEFT JOIN hashes h ON h.file_id = f.id "
+    "WHERE f.kind = 'video' AND h.file_id IS NULL")
+
+
+def scan(conn, roots: list[str], settings: Settings,
+         progress_cb: Optional[ProgressCb] = None,
+         hash_videos: bool = True) -> ScanResult:
+    """Walk roots into the database, then hash videos that lack hashes.
+
+    progress_cb(done, total, junk) is invoked every BATCH_SIZE files
+    during the walk and once per hashed video afterwards; total is
+    whatever estimate the caller seeded (the walk itself does not
+    pre-count).
+    """
+    result = ScanResult()
+    now = time.time()
+    file_rows: list[tuple] = []
+    for kind, path, size, mtime, pattern in iter_media_files(
+            roots, settings):
+        if kind == "junk":
+            # Basename only, like the classifier above: a dot in a
+            # directory name must not leak into the stored ext.
+            name = os.path.basename(path).lower()
+            dot = name.rfind(".")
+            dbm.upsert_junk(conn, path, size, mtime,
+                            name[dot:] if dot > 0 else "",
+                            pattern or "junk", now)
+            result.junk += 1
+            continue
+        file_rows.append((path, kind, size, mtime, now, now))
+        result.files += 1
+        if kind == "video":
+            result.videos += 1
+        if len(file_rows) >= BATCH_SIZE:
+            dbm.upsert_files_many(conn, file_rows)
+            file_rows.clear()
+            if progress_cb is not None:
+                progress_cb(result.files, 0, result.junk)
+    if file_rows:
+        dbm.upsert_files_many(conn, file_rows)
+    if progress_cb is not None:
+        progress_cb(result.files, 0, result.junk)
+    if hash_videos:
+        _hash_missing(conn, settings, result, progress_cb)
+    return result
+
+
+def _hash_missing(conn, settings: Settings, result: ScanResult,
+                  progress_cb: Optional[ProgressCb]) -> None:
+    todo = conn.execute(_UNHASHED_VIDEOS_SQL).fetchall()
+    if not todo:
+        return
+    rows: list[tuple] = []
+    with ThreadPoolExecutor(max_workers=settings.max_workers) as pool:
+        hashes = pool.map(
+            lambda t: _hash_file(t[1], t[2], settings), todo)
+        for (file_id, _path, _size), (sample, full) in zip(todo, hashes):
+            if sample is None:
+                continue
+            rows.append((file_id, settings.hash_algo,
+                         settings.sample_size, sample, full, time.time()))
+            result.hashed += 1
+            if progress_cb is not None:
+                progress_cb(result.hashed, len(todo), result.junk)
+            if len(rows) >= BATCH_SIZE:
+                dbm.upsert_hashes_many(conn, rows)
+                rows.clear()
+    if rows:
+        dbm.upsert_hashes_many(conn, rows)
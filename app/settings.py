@@ -0,0 +1,47 @@
+"""User-tunable settings shared by the GUI, scanner and organizer.
+
+Mirrors the agent's DEFAULT_CONFIG keys where they overlap so a config
+exported from the GUI can seed a remote agent unchanged.
+"""
+
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+
+@dataclass
+class Settings:
+    video_exts: list[str] = field(default_factory=lambda: [
+        ".mp4", ".mkv", ".avi", ".mov", ".wmv", ".flv", ".m4v",
+        ".mpg", ".mpeg", ".ts", ".webm"])
+    image_exts: list[str] = field(default_factory=lambda: [
+        ".jpg", ".jpeg", ".png", ".gif", ".bmp", ".tiff", ".webp"])
+    subtitle_exts: list[str] = field(default_factory=lambda: [
+        ".srt", ".sub", ".ass", ".ssa", ".vtt", ".idx"])
+    xml_exts: list[str] = field(default_factory=lambda: [".nfo", ".xml"])
+    other_exts: list[str] = field(default_factory=lambda: [
+        ".txt", ".json", ".log"])
+    junk_patterns: list[str] = field(default_factory=lambda: [
+        "*.tmp", "*.part", "*.crdownload", "*.!qb",
+        "thumbs.db", ".ds_store", "desktop.ini"])
+    junk_exclude_exts: list[str] = field(default_factory=list)
+    hash_algo: str = "sha256"
+    sample_size: int = 1048576
+    full_hash_max_bytes: int = 268435456
+    max_workers: int = 4
+    follow_links: bool = False
+    agent_ip: str = "127.0.0.1"
+    agent_port: int = 8799
+    server_port: int = 8765
+    naming_pattern: str = (
+        "{show}/Season {season:02d}/"
+        "{show} - S{season:02d}E{episode:02d}{ext}")
+
+    def to_dict(self) -> dict[str, Any]:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "Settings":
+        known = {f for f in cls.__dataclass_fields__}
+        return cls(**{k: v for k, v in data.items() if k in known})
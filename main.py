@@ -0,0 +1,6 @@
+"""Launcher for the Media Library Manager GUI."""
+
+from app.gui.main_window import main
+
+if __name__ == "__main__":
+    raise SystemExit(main())